@@ -1,13 +1,31 @@
 import sys
-import json
 import os
+import time
+STARTUP_CLOCK = time.perf_counter()  # 启动计时起点（导入 PyQt5 和扫描引擎之前）
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import freeze_support
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
-                            QWidget, QPushButton, QLabel, QLineEdit, QListWidget, 
-                            QListWidgetItem, QFileDialog, QMessageBox, QProgressBar,
-                            QCheckBox, QTextEdit, QSplitter, QGroupBox, QGridLayout, QComboBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
-from PyQt5.QtGui import QFont, QIcon
+                            QWidget, QPushButton, QLabel, QLineEdit, QListView, 
+                            QStyledItemDelegate, QFileDialog, QMessageBox, QProgressBar,
+                            QCheckBox, QTextEdit, QSplitter, QGroupBox, QGridLayout, QComboBox,
+                            QSpinBox)
+from PyQt5.QtCore import (Qt, QThread, pyqtSignal, QTimer, QAbstractListModel, QAbstractProxyModel,
+                          QModelIndex, QFileSystemWatcher)
+from PyQt5.QtGui import QFont, QIcon, QColor, QPalette
+from playlist_engine import (SCAN_INDEX_NAME, CACHE_NAME, PLAYLIST_REFS_NAME, TIMINGS_LOG_NAME, FILE_JOB_WORKERS,
+                             METADATA_CACHE_NAME, BEATSAVER_API, SESSION_NAME, SCAN_SNAPSHOT_NAME,
+                             get_app_dir, StageTimings, ScanSnapshot, load_session, save_session,
+                             BACKUP_FOLDER_NAME, MetadataCache, MetadataResolver, apply_metadata,
+                             find_restorable, RestoreSession,
+                             default_scan_workers, read_playlist, remove_playlist_entries, load_cache_info,
+                             SongLibrary, ScanIndex, PlaylistRefIndex, BackupSession, SongSearchIndex,
+                             SongRecord, find_duplicates, format_size, zstandard)
+
+SEARCH_DEBOUNCE_MS = 150            # 搜索框输入防抖间隔（毫秒）
+WATCH_DEBOUNCE_MS = 500             # 文件变化事件的合并窗口（毫秒），下载解压时会连续触发很多事件
+
 
 class FileProcessThread(QThread):
     """后台文件处理线程，用于扫描歌单和本地歌曲文件夹，避免阻塞主界面"""
@@ -15,127 +33,481 @@ class FileProcessThread(QThread):
     status_updated = pyqtSignal(str)
     finished_signal = pyqtSignal(list)
 
-    def __init__(self, playlist_path, songs_folder, cache_path=None):
+    def __init__(self, playlist_path, songs_folder, cache_path=None, index_path=None, force_rescan=False,
+                 executor_kind='thread', max_workers=None, use_cache_index=True, profile_path=None,
+                 metadata_path=None, snapshot_path=None):
         super().__init__()
         self.playlist_path = playlist_path
         self.songs_folder = songs_folder
         self.cache_path = cache_path  # LocalCache.saver 路径，可选
+        self.index_path = index_path  # 扫描索引路径，可选；为空时不使用索引
+        self.force_rescan = force_rescan  # 是否忽略索引强制完整扫描
+        self.executor_kind = executor_kind  # 并行解析方式：'thread' 线程池 / 'process' 进程池
+        self.max_workers = max_workers or default_scan_workers()  # 并行解析的工作线程/进程数
+        self.use_cache_index = use_cache_index  # 是否使用 LocalCache.saver 旁路索引
+        self.library = None  # 扫描得到的本地歌曲库，供查找孤立歌曲等功能复用
+        self.cache_info = {}  # 读取到的 LocalCache.saver 信息，供文件变化后的增量刷新复用
+        self.cache_wanted = set()  # cache_info 覆盖的 hash
+        self.profile_path = profile_path  # 不为空时用 cProfile 记录整个扫描并保存到此路径
+        self.metadata_path = metadata_path  # 联网查询的歌曲信息缓存，补充 LocalCache.saver 中没有的 hash
+        self.snapshot_path = snapshot_path  # 不为空时把扫描结果保存为快照，下次启动直接显示
+        self.timings = StageTimings()  # 各阶段耗时、数量和读取字节数
+        self._last_progress = -1
 
     def run(self):
+        if not self.profile_path:
+            self.scan()
+            return
+        # 进程池模式下子进程中的解析不会出现在分析结果中
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(self.scan)
+        finally:
+            try:
+                profiler.dump_stats(self.profile_path)
+            except OSError as e:
+                self.status_updated.emit(f"性能分析结果保存失败: {e}")
+
+    def scan(self):
+        timings = self.timings
         try:
             self.status_updated.emit("正在读取歌单文件...")
             # 读取歌单文件
-            with open(self.playlist_path, 'r', encoding='utf-8') as f:
-                playlist_data = json.load(f)
-            songs = playlist_data.get('songs', [])
+            with timings.stage('playlist') as record:
+                record['bytes'] = os.path.getsize(self.playlist_path)
+                playlist_data = read_playlist(self.playlist_path)
+                songs = playlist_data.get('songs', [])
+                record['count'] = len(songs)
             playlist_title = playlist_data.get('playlistTitle', '未知歌单')
-            song_name_set = set(song.get('songName', '') for song in songs)
-            song_hash_map = {song.get('songName', ''): song.get('hash', '') for song in songs}
             total_songs = len(songs)
             self.status_updated.emit(f"正在扫描 {total_songs} 首歌曲...（歌单名：{playlist_title}）")
 
-            # 读取 LocalCache.saver，建立hash到id/描述的映射
+            # 流式读取 LocalCache.saver，只保留歌单中出现的hash对应的id/描述
             cache_info = {}
+            wanted_hashes = set(song.get('hash', '').lower() for song in songs)
             if self.cache_path and os.path.exists(self.cache_path):
                 try:
-                    with open(self.cache_path, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                    for doc in cache_data.get('docs', []):
-                        for version in doc.get('versions', []):
-                            cache_info[version.get('hash', '').lower()] = {
-                                'id': doc.get('id', ''),
-                                'name': doc.get('name', ''),
-                                'description': doc.get('description', ''),
-                            }
+                    cache_info = load_cache_info(self.cache_path, wanted_hashes, use_index=self.use_cache_index,
+                                                 timings=timings)
                 except Exception as e:
                     self.status_updated.emit(f"LocalCache.saver 读取失败: {e}")
+            if self.metadata_path:
+                MetadataCache(self.metadata_path).load().fill(cache_info, wanted_hashes)
+            self.cache_info, self.cache_wanted = cache_info, wanted_hashes
 
-            # 扫描本地歌曲文件夹，提取info.dat和难度信息
-            local_song_map = {}  # _songName -> 歌曲信息字典
-            for folder in os.listdir(self.songs_folder):
-                folder_path = os.path.join(self.songs_folder, folder)
-                if not os.path.isdir(folder_path):
-                    continue
-                info_dat = os.path.join(folder_path, 'info.dat')
-                if not os.path.exists(info_dat):
-                    continue
-                try:
-                    with open(info_dat, 'r', encoding='utf-8') as f:
-                        info = json.load(f)
-                    local_song_name = info.get('_songName', '')
-                    author = info.get('_songAuthorName', '')
-                    # 获取所有实际存在的难度
-                    difficulties = []
-                    for dset in info.get('_difficultyBeatmapSets', []):
-                        for diff in dset.get('_difficultyBeatmaps', []):
-                            diff_name = diff.get('_difficulty')
-                            if diff_name and diff_name not in difficulties:
-                                difficulties.append(diff_name)
-                    # 检查是否有.egg文件
-                    egg_ok = any(f.endswith('.egg') for f in os.listdir(folder_path))
-                    # 通过歌单hash反查hash
-                    hash_guess = None
-                    for song in songs:
-                        if song.get('songName', '') == local_song_name:
-                            hash_guess = song.get('hash', '')
-                            break
-                    local_song_map[local_song_name] = {
-                        'folder': folder_path,
-                        'egg_ok': egg_ok,
-                        'author': author,
-                        'difficulties': difficulties,
-                        'hash': hash_guess
-                    }
-                except Exception:
-                    continue
+            # 扫描本地歌曲文件夹（签名未变的文件夹直接使用索引），进度按 文件夹数 + 歌单条目数 计算
+            folder_total = 0
+
+            def on_folder_progress(done, total):
+                nonlocal folder_total
+                folder_total = total
+                self.report_progress(done, total + total_songs)
+
+            library = self.library = SongLibrary(self.songs_folder).scan(
+                index_path=self.index_path, force_rescan=self.force_rescan,
+                executor_kind=self.executor_kind, max_workers=self.max_workers,
+                progress=on_folder_progress, status=self.status_updated.emit, timings=timings)
+            index_note = ""
+            if self.index_path:
+                index_note = f"（索引命中 {library.index_hits}，重新解析 {library.index_misses}）"
 
             # 生成歌单顺序的歌曲信息列表
-            song_info_list = []
-            for i, song in enumerate(songs):
-                progress = int((i + 1) / total_songs * 100) if total_songs else 100
-                self.progress_updated.emit(progress)
-                song_name = song.get('songName', '')
-                song_hash = song.get('hash', '').lower()
-                local_info = local_song_map.get(song_name)
-                exists = False
-                folder = ""
-                author = ""
-                difficulties = []
-                if local_info and local_info['egg_ok']:
-                    exists = True
-                    folder = local_info['folder']
-                    author = local_info['author']
-                    difficulties = local_info['difficulties']
-
-                # LocalCache.saver 信息
-                cache = cache_info.get(song_hash, {})
-                cache_id = cache.get('id', '')
-                cache_desc = cache.get('description', '')
-
-                song_info_list.append({
-                    'name': song_name,         # 歌名
-                    'hash': song_hash,         # 歌曲hash
-                    'exists': exists,          # 是否存在本地
-                    'path': folder,            # 歌曲文件夹路径
-                    'author': author,          # 歌手名
-                    'difficulties': difficulties, # 实际存在的所有难度
-                    'cache_id': cache_id,      # LocalCache.saver中的id
-                    'cache_desc': cache_desc   # LocalCache.saver中的描述
-                })
-
-            self.status_updated.emit("扫描完成！")
+            with timings.stage('match') as record:
+                record['count'] = total_songs
+                song_info_list = library.match(
+                    songs, cache_info,
+                    progress=lambda i: self.report_progress(folder_total + i, folder_total + total_songs))
+            if self.snapshot_path:
+                with timings.stage('snapshot') as record:
+                    record['count'] = len(song_info_list)
+                    try:
+                        ScanSnapshot(self.snapshot_path).save(self.playlist_path, self.songs_folder, song_info_list)
+                    except OSError as e:
+                        self.status_updated.emit(f"扫描快照保存失败: {e}")
+
+            self.progress_updated.emit(100)
+            self.status_updated.emit(f"扫描完成！{index_note}")
             self.finished_signal.emit(song_info_list)
 
         except Exception as e:
             self.status_updated.emit(f"错误: {str(e)}")
 
+    def report_progress(self, done, total):
+        """按百分比发送进度，百分比不变时不重复发送信号"""
+        progress = int(done / total * 100) if total else 100
+        if progress != self._last_progress:
+            self._last_progress = progress
+            self.progress_updated.emit(progress)
+
+
+class SongWatchThread(QThread):
+    """文件变化后的增量刷新线程：只重新解析受影响的歌曲文件夹，再用新的歌曲库重新匹配歌单
+
+    在歌曲库副本上刷新，完成后由主线程替换；LocalCache.saver 只在其变化或歌单出现新 hash 时重新读取。
+    """
+    status_updated = pyqtSignal(str)
+    finished_signal = pyqtSignal(list, list)  # 歌曲信息列表, 暂时无法解析的文件夹名
+
+    def __init__(self, library, playlist_path, folders=(), cache_path=None, cache_info=None, cache_wanted=(),
+                 cache_changed=False, index_path=None, use_cache_index=True, metadata_path=None):
+        super().__init__()
+        self.library = library.copy()
+        self.playlist_path = playlist_path
+        self.folders = set(folders)  # 内容有变化的歌曲文件夹名
+        self.cache_path = cache_path
+        self.cache_info = cache_info or {}
+        self.cache_wanted = set(cache_wanted)
+        self.cache_changed = cache_changed  # LocalCache.saver 是否有变化
+        self.index_path = index_path
+        self.use_cache_index = use_cache_index
+        self.metadata_path = metadata_path
+        self.changed = []  # 本次有变化的文件夹名
+
+    def run(self):
+        try:
+            self.changed, incomplete = self.library.refresh(self.folders, self.index_path)
+            songs = read_playlist(self.playlist_path).get('songs', [])
+            wanted_hashes = set(song.get('hash', '').lower() for song in songs)
+            if self.cache_changed or not wanted_hashes <= self.cache_wanted:
+                self.cache_info = {}
+                if self.cache_path and os.path.exists(self.cache_path):
+                    try:
+                        self.cache_info = load_cache_info(self.cache_path, wanted_hashes,
+                                                          use_index=self.use_cache_index)
+                    except Exception as e:
+                        self.status_updated.emit(f"LocalCache.saver 读取失败: {e}")
+                if self.metadata_path:
+                    MetadataCache(self.metadata_path).load().fill(self.cache_info, wanted_hashes)
+                self.cache_wanted = wanted_hashes
+            self.finished_signal.emit(self.library.match(songs, self.cache_info), incomplete)
+        except Exception as e:
+            self.status_updated.emit(f"自动更新失败: {str(e)}")
+
+
+class MetadataThread(QThread):
+    """后台联网补全歌曲信息：查询 LocalCache.saver 和本地缓存中都没有的 hash，每批完成后立即发送结果
+
+    查询在本线程的 asyncio 事件循环中进行（并发数有界、连接复用），结果写入程序同级的 BeatSaverCache.json。
+    """
+    batch_resolved = pyqtSignal(dict)           # 本批查询到的 {hash: id/名称/描述}
+    finished_signal = pyqtSignal(int, int, list)  # 查询到的数量, BeatSaver 上不存在的数量, 错误信息
+
+    def __init__(self, hashes, cache_path, base_url=BEATSAVER_API):
+        super().__init__()
+        self.hashes = hashes
+        self.cache_path = cache_path
+        self.base_url = base_url
+
+    def on_batch(self, results):
+        found = {song_hash: entry for song_hash, entry in results.items() if entry}
+        if found:
+            self.batch_resolved.emit(found)
+
+    def run(self):
+        errors = []
+        results = {}
+        cache = MetadataCache(self.cache_path).load()
+        hashes = cache.unknown(self.hashes)
+        if hashes:
+            import asyncio
+            try:
+                asyncio.run(MetadataResolver(self.base_url).resolve(hashes, self.on_batch, errors, results))
+            except Exception as e:
+                errors.append(str(e))  # 已完成的批次仍在 results 中，照常写入缓存
+            cache.update(results)
+            try:
+                cache.save()
+            except OSError as e:
+                errors.append(f"歌曲信息缓存保存失败: {e}")
+        resolved = sum(1 for entry in results.values() if entry)
+        self.finished_signal.emit(resolved, len(results) - resolved, errors)
+
+
+class DuplicateScanThread(QThread):
+    """后台查找重复的歌曲文件夹（只对疑似重复的文件夹列目录和计算内容摘要）"""
+    progress_updated = pyqtSignal(int, int)   # 已处理文件夹数, 总数
+    finished_signal = pyqtSignal(list)
+
+    def __init__(self, library, max_workers=None, matched_folders=()):
+        super().__init__()
+        self.library = library
+        self.max_workers = max_workers
+        self.matched_folders = matched_folders  # 当前歌单匹配到的文件夹，优先保留、不作为重复文件夹删除
+
+    def run(self):
+        self.finished_signal.emit(find_duplicates(self.library, self.max_workers, progress=self.progress_updated.emit,
+                                                  matched_folders=self.matched_folders))
+
+
+class BackupLookupThread(QThread):
+    """后台在备份中查找缺失的歌曲（没有清单条目的旧备份文件夹需要计算 hash），可随时取消"""
+    progress_updated = pyqtSignal(int, int)   # 已计算 hash 的旧备份文件夹数, 总数
+    finished_signal = pyqtSignal(dict, bool)  # {小写 hash: 清单条目}, 是否已取消
+
+    def __init__(self, backup_folder, hashes):
+        super().__init__()
+        self.backup_folder = backup_folder
+        self.hashes = hashes
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        found = find_restorable(self.backup_folder, self.hashes, progress=self.progress_updated.emit,
+                                cancelled=self._cancel_event.is_set)
+        self.finished_signal.emit(found, self._cancel_event.is_set())
+
+
+class FileJobThread(QThread):
+    """后台文件任务线程：用有界线程池并行处理一批条目（如删除歌曲），可随时取消
+
+    job_func(item) 在线程池中执行，抛出的异常记为该条目失败。取消后尚未开始的条目不再处理，
+    正在处理的条目会继续完成。结果汇总为 {'done': [...], 'failed': [(item, 错误信息)], 'cancelled': bool}。
+    """
+    progress_updated = pyqtSignal(int, int)   # 已处理数, 总数
+    item_failed = pyqtSignal(str, str)        # 条目名称, 错误信息
+    finished_signal = pyqtSignal(dict)
+
+    def __init__(self, items, job_func, item_name=str, max_workers=FILE_JOB_WORKERS):
+        super().__init__()
+        self.items = items
+        self.job_func = job_func
+        self.item_name = item_name  # 用于错误提示的条目名称
+        self.max_workers = max_workers
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        """请求取消，尚未开始的条目将被跳过"""
+        self._cancel_event.set()
+
+    def run_one(self, item):
+        if self._cancel_event.is_set():
+            return False
+        self.job_func(item)
+        return True
+
+    def run(self):
+        result = {'done': [], 'failed': [], 'cancelled': False}
+        total = len(self.items)
+        processed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.run_one, item): item for item in self.items}
+            for future in as_completed(futures):
+                item = futures[future]
+                processed += 1
+                try:
+                    if future.result():
+                        result['done'].append(item)
+                except Exception as e:
+                    result['failed'].append((item, str(e)))
+                    self.item_failed.emit(self.item_name(item), str(e))
+                self.progress_updated.emit(processed, total)
+        result['cancelled'] = self._cancel_event.is_set()
+        self.finished_signal.emit(result)
+
+
+SONG_HASH_ROLE = Qt.UserRole        # 歌曲hash，删除时据此与数据一一对应
+SONG_EXISTS_ROLE = Qt.UserRole + 1  # 歌曲是否存在本地，供委托决定颜色
+
+
+class SongListModel(QAbstractListModel):
+    """歌曲列表模型：保存全部歌曲信息和勾选状态，显示文本只在视图需要时生成"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.songs = []     # 歌曲信息列表（歌单顺序）
+        self.checked = []   # 与 songs 一一对应的勾选状态
+
+    def set_songs(self, songs):
+        """替换全部歌曲，勾选状态清空"""
+        self.beginResetModel()
+        self.songs = songs
+        self.checked = [False] * len(songs)
+        self.endResetModel()
+
+    def update_songs(self, songs):
+        """替换全部歌曲，按 hash 保留勾选状态（文件变化后自动刷新时使用）"""
+        checked_hashes = set(song.hash for song, checked in zip(self.songs, self.checked) if checked)
+        self.beginResetModel()
+        self.songs = songs
+        self.checked = [song.hash in checked_hashes for song in songs]
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.songs)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        song = self.songs[index.row()]
+        if role == Qt.DisplayRole:
+            return song_display_text(song)
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.checked[index.row()] else Qt.Unchecked
+        if role == Qt.ToolTipRole:
+            tips = [song.cache_desc] if song.cache_desc else []
+            if song.missing_files:
+                tips.append("缺少文件：" + ", ".join(song.missing_files))
+            return "\n\n".join(tips) or None
+        if role == SONG_HASH_ROLE:
+            return song.hash
+        if role == SONG_EXISTS_ROLE:
+            return song.exists
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or not index.isValid():
+            return False
+        self.checked[index.row()] = (value == Qt.Checked)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def refresh_rows(self, rows):
+        """歌曲信息（如联网补全的 ID 和描述）有变化的行重新显示"""
+        if rows:
+            self.dataChanged.emit(self.index(min(rows)), self.index(max(rows)), [Qt.DisplayRole, Qt.ToolTipRole])
+
+    def set_checked(self, rows, checked):
+        """批量设置勾选状态，只发送一次 dataChanged"""
+        rows = list(rows)
+        if not rows:
+            return
+        for row in rows:
+            self.checked[row] = checked
+        self.dataChanged.emit(self.index(min(rows)), self.index(max(rows)), [Qt.CheckStateRole])
+
+
+class SongFilterProxyModel(QAbstractProxyModel):
+    """歌曲列表的筛选/排序代理模型
+
+    只保存可见行对应的源模型行号，筛选或排序变化时通过 SongSearchIndex 重新计算行号列表，
+    不会创建任何控件。源模型重置（重新扫描）时重建搜索索引。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []                          # 代理行 -> 源模型行
+        self._source_to_row = None              # 源模型行 -> 代理行，按需生成
+        self.search_index = SongSearchIndex([])
+        self.criteria = (0, 0, False, '')
+
+    def setSourceModel(self, model):
+        super().setSourceModel(model)
+        # 源模型重置（重新扫描）时代理模型随之重置，并按当前条件重新计算可见行
+        model.modelAboutToBeReset.connect(self.beginResetModel)
+        model.modelReset.connect(self.on_source_reset)
+        model.dataChanged.connect(self.on_source_data_changed)
+
+    def set_criteria(self, filter_mode, sort_mode, only_missing, keyword):
+        """设置筛选模式、排序方式、是否仅显示缺失和搜索关键字（已小写）"""
+        self.criteria = (filter_mode, sort_mode, only_missing, keyword)
+        self.beginResetModel()
+        self.recompute_rows()
+        self.endResetModel()
+
+    def recompute_rows(self):
+        """按当前条件重新计算可见行"""
+        self.rows = self.search_index.search(*self.criteria)
+        self._source_to_row = None
+
+    @property
+    def source_to_row(self):
+        if self._source_to_row is None:
+            self._source_to_row = {source_row: row for row, source_row in enumerate(self.rows)}
+        return self._source_to_row
+
+    def on_source_reset(self):
+        self.search_index = SongSearchIndex(self.sourceModel().songs)
+        self.recompute_rows()
+        self.endResetModel()
+
+    def on_source_data_changed(self, top_left, bottom_right, roles=()):
+        source_to_row = self.source_to_row
+        mapped = [source_to_row[row] for row in range(top_left.row(), bottom_right.row() + 1)
+                  if row in source_to_row]
+        if mapped:
+            self.dataChanged.emit(self.index(min(mapped), 0), self.index(max(mapped), 0), roles)
+
+    def index(self, row, column=0, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self.rows)) or column != 0:
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self.rows[proxy_index.row()])
+
+    def mapFromSource(self, source_index):
+        row = self.source_to_row.get(source_index.row()) if source_index.isValid() else None
+        return QModelIndex() if row is None else self.index(row)
+
+
+class SongItemDelegate(QStyledItemDelegate):
+    """按歌曲是否存在设置文字颜色：存在为绿色，缺失为红色"""
+    EXISTS_COLOR = QColor('green')
+    MISSING_COLOR = QColor('red')
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        color = self.EXISTS_COLOR if index.data(SONG_EXISTS_ROLE) else self.MISSING_COLOR
+        option.palette.setColor(QPalette.Text, color)
+
+
+def song_display_text(song):
+    """生成列表中显示的文本：歌名 - 作者 [难度] (ID:xxx)"""
+    author = song.author
+    diff_str = '/'.join(song.difficulties)
+    cache_id = song.cache_id
+    display_text = f"{song.name}"
+    if author:
+        display_text += f" - {author}"
+    if diff_str:
+        display_text += f" [{diff_str}]"
+    if cache_id:
+        display_text += f" (ID:{cache_id})"
+    return display_text
+
+
 class BeatSaberPlaylistManager(QMainWindow):
     def __init__(self):
         super().__init__()
         self.playlist_path = ""     # 歌单文件路径
         self.songs_folder = ""      # 歌曲文件夹路径
         self.song_list = []         # 歌曲信息列表
+        self.library = None         # 最近一次扫描的本地歌曲库
+        self.cache_info = {}        # 最近一次读取的 LocalCache.saver 信息
+        self.cache_wanted = set()   # cache_info 覆盖的 hash
         self.backup_enabled = True  # 是否启用备份
+        self.scan_thread = None
+        self.delete_thread = None
+        self.watch_thread = None
+        self.metadata_thread = None
+        self.restore_thread = None
+        self.restore_lookup_thread = None
+        self.duplicate_thread = None
+        self.watch_folders = set()       # 合并窗口内内容有变化的歌曲文件夹名
+        self.watch_pending = False       # 是否有尚未处理的文件变化
+        self.watch_cache_changed = False  # 合并窗口内 LocalCache.saver 是否有变化
+        self.incomplete_folders = set()  # 暂时无法解析（可能仍在下载中）的文件夹名，单独监视
+        self.snapshot_shown = False      # 列表是否为上次保存的快照（尚未经扫描校验）
+        self.startup_timings = None      # 启动各阶段耗时，首次绘制后写入日志
         
         self.init_ui()
         
@@ -176,6 +548,24 @@ class BeatSaberPlaylistManager(QMainWindow):
         file_layout.addWidget(self.folder_edit, 1, 1)
         file_layout.addWidget(self.folder_btn, 1, 2)
         
+        # 扫描方式与并行数
+        self.scan_mode_label = QLabel("扫描方式：")
+        scan_mode_layout = QHBoxLayout()
+        self.scan_mode_combo = QComboBox()
+        self.scan_mode_combo.addItem("线程池", 'thread')
+        self.scan_mode_combo.addItem("进程池", 'process')
+        self.scan_mode_combo.setToolTip("机械硬盘/网络共享建议线程池，固态硬盘且歌曲很多时可尝试进程池")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 64)
+        self.workers_spin.setValue(default_scan_workers())
+        self.workers_spin.setPrefix("并行数：")
+        scan_mode_layout.addWidget(self.scan_mode_combo)
+        scan_mode_layout.addWidget(self.workers_spin)
+        scan_mode_layout.addStretch()
+        
+        file_layout.addWidget(self.scan_mode_label, 2, 0)
+        file_layout.addLayout(scan_mode_layout, 2, 1)
+        
         file_group.setLayout(file_layout)
         main_layout.addWidget(file_group)
         
@@ -187,9 +577,38 @@ class BeatSaberPlaylistManager(QMainWindow):
         self.scan_btn.clicked.connect(self.scan_songs)
         self.scan_btn.setStyleSheet("QPushButton { background-color: #4CAF50; color: white; font-weight: bold; }")
         
+        # 强制完整扫描复选框（忽略扫描索引，重新解析所有 info.dat）
+        self.force_rescan_checkbox = QCheckBox("强制完整扫描")
+        self.force_rescan_checkbox.setToolTip("忽略扫描索引，重新解析所有歌曲文件夹")
+
+        # LocalCache.saver 旁路索引复选框
+        self.cache_index_checkbox = QCheckBox("缓存索引")
+        self.cache_index_checkbox.setChecked(True)
+        self.cache_index_checkbox.setToolTip("为 LocalCache.saver 建立 hash 偏移索引（LocalCache.saver.idx），文件未变化时只读取需要的条目")
+
+        # 性能分析复选框：扫描时用 cProfile 记录完整调用耗时
+        self.profile_checkbox = QCheckBox("性能分析")
+        self.profile_checkbox.setToolTip("扫描时用 cProfile 记录完整的调用耗时，保存为程序同级的 scan-时间.prof，"
+                                         "可用 python -m pstats 查看")
+
+        # 联网补全复选框：扫描后向 BeatSaver 查询 LocalCache.saver 中没有的歌曲信息
+        self.metadata_checkbox = QCheckBox("联网补全信息")
+        self.metadata_checkbox.setToolTip(f"扫描后向 {BEATSAVER_API} 查询 LocalCache.saver 中没有的歌曲 ID 和描述，"
+                                          f"结果缓存在程序同级的 {METADATA_CACHE_NAME}，之后的扫描不再重复查询")
+        self.metadata_checkbox.toggled.connect(self.toggle_metadata_fetch)
+
         # 删除前备份复选框
         self.backup_checkbox = QCheckBox("删除前备份")
         self.backup_checkbox.setChecked(True)
+
+        # 跨盘备份方式：同盘时总是直接移动文件夹
+        self.archive_combo = QComboBox()
+        self.archive_combo.addItem("跨盘：复制文件夹", None)
+        self.archive_combo.addItem("跨盘：zip 归档", 'zip')
+        if zstandard is not None:
+            self.archive_combo.addItem("跨盘：tar.zst 归档", 'tar.zst')
+        self.archive_combo.setToolTip("歌曲文件夹与 backup 在同一磁盘时直接移动（零拷贝）；不在同一磁盘时按此方式备份")
+        self.backup_checkbox.toggled.connect(self.archive_combo.setEnabled)
         
         # 全选/取消全选按钮
         self.select_all_btn = QPushButton("全选")
@@ -221,11 +640,35 @@ class BeatSaberPlaylistManager(QMainWindow):
         # 搜索框
         self.search_edit = QLineEdit()
         self.search_edit.setPlaceholderText("搜索歌名或作者")
-        self.search_edit.textChanged.connect(self.update_song_list)
+        # 输入停顿后再刷新列表，连续输入时不重复筛选
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.update_song_list)
+        self.search_edit.textChanged.connect(self.search_timer.start)
+        
+        # 监视文件变化：歌曲文件夹、歌单和 LocalCache.saver 变化后自动增量刷新列表
+        self.watch_checkbox = QCheckBox("监视文件变化")
+        self.watch_checkbox.setToolTip("扫描后监视歌曲文件夹、歌单和 LocalCache.saver，"
+                                       "有变化时只重新解析受影响的文件夹并自动更新列表")
+        self.watch_checkbox.toggled.connect(self.toggle_watch)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_watched_dir_changed)
+        self.watcher.fileChanged.connect(self.on_watched_file_changed)
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(WATCH_DEBOUNCE_MS)
+        self.watch_timer.timeout.connect(self.run_watch_update)
         
         # 控件加入布局
         control_layout.addWidget(self.scan_btn)
+        control_layout.addWidget(self.force_rescan_checkbox)
+        control_layout.addWidget(self.cache_index_checkbox)
+        control_layout.addWidget(self.watch_checkbox)
+        control_layout.addWidget(self.profile_checkbox)
+        control_layout.addWidget(self.metadata_checkbox)
         control_layout.addWidget(self.backup_checkbox)
+        control_layout.addWidget(self.archive_combo)
         control_layout.addWidget(self.filter_combo)
         control_layout.addWidget(self.sort_combo)
         control_layout.addWidget(self.only_missing_checkbox)
@@ -248,9 +691,15 @@ class BeatSaberPlaylistManager(QMainWindow):
         list_group = QGroupBox("歌曲列表")
         list_layout = QVBoxLayout()
         
-        self.song_list_widget = QListWidget()
-        self.song_list_widget.setAlternatingRowColors(True)
-        list_layout.addWidget(self.song_list_widget)
+        self.song_model = SongListModel(self)
+        self.song_proxy = SongFilterProxyModel(self)
+        self.song_proxy.setSourceModel(self.song_model)
+        self.song_list_view = QListView()
+        self.song_list_view.setModel(self.song_proxy)
+        self.song_list_view.setItemDelegate(SongItemDelegate(self.song_list_view))
+        self.song_list_view.setUniformItemSizes(True)  # 行高一致，视图只需布局可见行
+        self.song_list_view.setAlternatingRowColors(True)
+        list_layout.addWidget(self.song_list_view)
         
         list_group.setLayout(list_layout)
         splitter.addWidget(list_group)
@@ -283,6 +732,40 @@ class BeatSaberPlaylistManager(QMainWindow):
         self.delete_btn.setStyleSheet("QPushButton { background-color: #f44336; color: white; font-weight: bold; }")
         self.delete_btn.setEnabled(False)
         
+        # 取消按钮，仅在删除或恢复进行中显示
+        self.cancel_btn = QPushButton("取消删除")
+        self.cancel_btn.clicked.connect(self.cancel_delete)
+        self.cancel_btn.setVisible(False)
+        
+        # 重新校验按钮：删除后列表只在内存中更新，需要时可重新扫描与磁盘核对
+        self.verify_btn = QPushButton("重新校验")
+        self.verify_btn.setToolTip("重新扫描歌单和歌曲文件夹，核对列表与磁盘是否一致")
+        self.verify_btn.clicked.connect(self.scan_songs)
+        self.verify_btn.setEnabled(False)
+        
+        # 查找孤立歌曲按钮：列出没有被任何歌单引用的歌曲文件夹
+        self.orphans_btn = QPushButton("查找孤立歌曲")
+        self.orphans_btn.setToolTip("查找没有被歌单所在目录中任何歌单引用的歌曲文件夹")
+        self.orphans_btn.clicked.connect(self.find_orphans)
+        self.orphans_btn.setEnabled(False)
+        
+        # 查找重复歌曲按钮：同一谱面的多个文件夹，可删除多余的副本
+        self.duplicates_btn = QPushButton("查找重复歌曲")
+        self.duplicates_btn.setToolTip("按谱面 hash 和文件内容查找重复的歌曲文件夹，并统计可释放的空间")
+        self.duplicates_btn.clicked.connect(self.find_duplicate_folders)
+        self.duplicates_btn.setEnabled(False)
+        
+        # 从备份恢复按钮：按备份清单把缺失的歌曲恢复到歌曲文件夹
+        self.restore_btn = QPushButton("从备份恢复")
+        self.restore_btn.setToolTip("在 backup 的备份清单中查找列表里缺失的歌曲（包括 zip/tar.zst 归档中的），恢复到歌曲文件夹")
+        self.restore_btn.clicked.connect(self.restore_missing)
+        self.restore_btn.setEnabled(False)
+        
+        delete_layout.addWidget(self.restore_btn)
+        delete_layout.addWidget(self.duplicates_btn)
+        delete_layout.addWidget(self.orphans_btn)
+        delete_layout.addWidget(self.verify_btn)
+        delete_layout.addWidget(self.cancel_btn)
         delete_layout.addWidget(self.delete_btn)
         main_layout.addLayout(delete_layout)
         
@@ -310,6 +793,135 @@ class BeatSaberPlaylistManager(QMainWindow):
             }
         """)
     
+    def session_checkboxes(self):
+        """随会话保存的复选框（强制完整扫描、性能分析等一次性选项除外）"""
+        return {'cache_index': self.cache_index_checkbox, 'watch': self.watch_checkbox,
+                'metadata': self.metadata_checkbox, 'backup': self.backup_checkbox}
+
+    def session_state(self):
+        """当前的歌单、歌曲文件夹和界面选项"""
+        return {
+            'playlist_path': self.playlist_path,
+            'songs_folder': self.songs_folder,
+            'filter_mode': self.filter_combo.currentIndex(),
+            'sort_mode': self.sort_combo.currentIndex(),
+            'only_missing': self.only_missing_checkbox.isChecked(),
+            'keyword': self.search_edit.text(),
+            'scan_mode': self.scan_mode_combo.currentData(),
+            'workers': self.workers_spin.value(),
+            'archive': self.archive_combo.currentData(),
+            'options': {name: checkbox.isChecked() for name, checkbox in self.session_checkboxes().items()},
+        }
+
+    def restore_session(self):
+        """恢复上次的界面状态；歌单和歌曲文件夹都还在且有对应的快照时直接显示上次的歌曲列表，返回显示的歌曲数"""
+        session = load_session(os.path.join(get_app_dir(), SESSION_NAME))
+        if not session:
+            return 0
+        checkboxes = self.session_checkboxes()
+        widgets = [self.filter_combo, self.sort_combo, self.only_missing_checkbox, self.search_edit,
+                   self.scan_mode_combo, self.workers_spin, self.archive_combo] + list(checkboxes.values())
+        # 只恢复控件状态，不触发筛选、监视和联网查询（扫描完成后才会用到）
+        for widget in widgets:
+            widget.blockSignals(True)
+        try:
+            self.filter_combo.setCurrentIndex(session.get('filter_mode', 0))
+            self.sort_combo.setCurrentIndex(session.get('sort_mode', 0))
+            self.only_missing_checkbox.setChecked(session.get('only_missing', False))
+            self.search_edit.setText(session.get('keyword', ''))
+            self.scan_mode_combo.setCurrentIndex(max(0, self.scan_mode_combo.findData(session.get('scan_mode'))))
+            self.workers_spin.setValue(session.get('workers', self.workers_spin.value()))
+            self.archive_combo.setCurrentIndex(max(0, self.archive_combo.findData(session.get('archive'))))
+            for name, checked in session.get('options', {}).items():
+                if name in checkboxes:
+                    checkboxes[name].setChecked(checked)
+        except (TypeError, ValueError):
+            pass  # 会话文件内容不符时保留默认值
+        finally:
+            for widget in widgets:
+                widget.blockSignals(False)
+        self.archive_combo.setEnabled(self.backup_checkbox.isChecked())
+        self.update_song_list()
+
+        playlist_path, songs_folder = session.get('playlist_path', ''), session.get('songs_folder', '')
+        if not (playlist_path and songs_folder and os.path.isfile(playlist_path) and os.path.isdir(songs_folder)):
+            return 0
+        self.playlist_path, self.songs_folder = playlist_path, songs_folder
+        self.playlist_edit.setText(playlist_path)
+        self.folder_edit.setText(songs_folder)
+        self.update_scan_button_state()
+        snapshot = ScanSnapshot(os.path.join(get_app_dir(), SCAN_SNAPSHOT_NAME))
+        if not snapshot.load(playlist_path, songs_folder):
+            return 0
+        self.song_list = snapshot.songs
+        self.song_model.set_songs(self.song_list)
+        self.snapshot_shown = True
+        self.update_info_text(f"已显示上次的扫描结果（{time.strftime('%Y-%m-%d %H:%M', time.localtime(snapshot.saved_at))}），"
+                              f"正在后台校验...")
+        return len(self.song_list)
+
+    def persist_session(self):
+        """保存界面状态和当前列表的快照（删除、自动刷新后的列表也会保存），下次启动直接恢复"""
+        try:
+            save_session(os.path.join(get_app_dir(), SESSION_NAME), self.session_state())
+            # 只保存与当前歌单、歌曲文件夹对应且已扫描校验过的列表
+            if (self.library is not None and not self.snapshot_shown
+                    and self.scan_thread.playlist_path == self.playlist_path
+                    and self.library.songs_folder == self.songs_folder):
+                ScanSnapshot(os.path.join(get_app_dir(), SCAN_SNAPSHOT_NAME)).save(
+                    self.playlist_path, self.songs_folder, self.song_list)
+        except OSError as e:
+            with open("error.log", "a", encoding="utf-8") as logf:
+                logf.write(f"会话保存失败: {e}\n")
+
+    def closeEvent(self, event):
+        """关闭窗口：删除或恢复进行中时先确认，取消尚未开始的条目并等待后台线程结束
+
+        线程仍在运行时被销毁会使程序直接退出，可能停在移动或删除文件夹的中途，备份清单也来不及写入。
+        """
+        if any(thread is not None and thread.isRunning() for thread in (self.delete_thread, self.restore_thread)):
+            reply = QMessageBox.question(
+                self, "确认关闭",
+                "删除或恢复正在进行。关闭窗口会取消尚未开始的歌曲，并等待进行中的歌曲处理完成。确定关闭吗？",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                event.ignore()
+                return
+        self.watch_timer.stop()
+        self.watch_pending = False
+        self.cancel_delete()
+        self.status_label.setText("正在等待后台任务结束...")
+        self.wait_background_threads()
+        # 处理线程结束前发出的完成信号：与正常结束时一样写入备份清单、更新歌单
+        QApplication.processEvents()
+        self.wait_background_threads()  # 恢复完成后会启动校验线程
+        self.persist_session()
+        super().closeEvent(event)
+
+    def wait_background_threads(self):
+        for thread in (self.scan_thread, self.delete_thread, self.restore_lookup_thread, self.restore_thread,
+                       self.watch_thread, self.metadata_thread, self.duplicate_thread):
+            if thread is not None:
+                thread.wait()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.startup_timings is not None:
+            timings, self.startup_timings = self.startup_timings, None
+            # 从 main() 中最后一个阶段结束到这里即窗口显示到首次绘制
+            timings.add('first_paint', time.perf_counter() - STARTUP_CLOCK - timings.total_seconds())
+            QTimer.singleShot(0, lambda: self.on_first_paint(timings))
+
+    def on_first_paint(self, timings):
+        """记录启动到首次绘制的耗时；显示的是快照时随后开始后台校验扫描"""
+        self.write_timings_log(timings, event='startup', songs=len(self.song_list), snapshot=self.snapshot_shown)
+        startup_note = f"启动到首次绘制：{timings.total_seconds() * 1000:.0f} ms"
+        if not self.snapshot_shown:
+            self.status_label.setText(f"就绪（{startup_note}）")
+            return
+        self.info_text.append(f"\n{startup_note}\n{timings.summary()}")
+        self.scan_songs()
+
     def select_playlist(self):
         """选择歌单文件"""
         file_path, _ = QFileDialog.getOpenFileName(
@@ -317,6 +929,7 @@ class BeatSaberPlaylistManager(QMainWindow):
         if file_path:
             self.playlist_path = file_path
             self.playlist_edit.setText(file_path)
+            self.stop_watching()  # 重新扫描后再监视新的歌单
             self.update_scan_button_state()
     
     def select_folder(self):
@@ -325,6 +938,7 @@ class BeatSaberPlaylistManager(QMainWindow):
         if folder_path:
             self.songs_folder = folder_path
             self.folder_edit.setText(folder_path)
+            self.stop_watching()
             self.update_scan_button_state()
     
     def update_scan_button_state(self):
@@ -338,15 +952,29 @@ class BeatSaberPlaylistManager(QMainWindow):
             return
 
         # 自动查找 LocalCache.saver（与主程序同级）
-        cache_path = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "LocalCache.saver")
+        cache_path = os.path.join(get_app_dir(), CACHE_NAME)
         if not os.path.exists(cache_path):
             cache_path = None  # 不存在则不传
 
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
         self.scan_btn.setEnabled(False)
+        self.verify_btn.setEnabled(False)
+        self.orphans_btn.setEnabled(False)
+        self.duplicates_btn.setEnabled(False)
+        self.restore_btn.setEnabled(False)
 
-        self.scan_thread = FileProcessThread(self.playlist_path, self.songs_folder, cache_path=cache_path)
+        self.scan_thread = FileProcessThread(
+            self.playlist_path, self.songs_folder, cache_path=cache_path,
+            index_path=os.path.join(get_app_dir(), SCAN_INDEX_NAME),
+            force_rescan=self.force_rescan_checkbox.isChecked(),
+            executor_kind=self.scan_mode_combo.currentData(),
+            max_workers=self.workers_spin.value(),
+            use_cache_index=self.cache_index_checkbox.isChecked(),
+            profile_path=os.path.join(get_app_dir(), time.strftime("scan-%Y%m%d-%H%M%S.prof"))
+            if self.profile_checkbox.isChecked() else None,
+            metadata_path=os.path.join(get_app_dir(), METADATA_CACHE_NAME),
+            snapshot_path=os.path.join(get_app_dir(), SCAN_SNAPSHOT_NAME))
         self.scan_thread.progress_updated.connect(self.progress_bar.setValue)
         self.scan_thread.status_updated.connect(self.status_label.setText)
         self.scan_thread.finished_signal.connect(self.on_scan_finished)
@@ -355,126 +983,280 @@ class BeatSaberPlaylistManager(QMainWindow):
     def on_scan_finished(self, song_list):
         """扫描完成后，刷新界面和信息"""
         self.song_list = song_list
-        self.update_song_list()
+        self.library = self.scan_thread.library
+        self.cache_info, self.cache_wanted = self.scan_thread.cache_info, self.scan_thread.cache_wanted
+        timings = self.scan_thread.timings
+        with timings.stage('ui_populate') as record:
+            # 代理模型会按当前筛选条件自动刷新；校验启动时显示的快照时保留勾选状态
+            if self.snapshot_shown:
+                self.song_model.update_songs(song_list)
+            else:
+                self.song_model.set_songs(song_list)
+            record['count'] = len(self.song_proxy.rows)
+        title = "校验完成！已用本次扫描结果替换上次的快照。" if self.snapshot_shown else "扫描完成！"
+        self.snapshot_shown = False
         
         # 隐藏进度条
         self.progress_bar.setVisible(False)
         self.scan_btn.setEnabled(True)
         self.delete_btn.setEnabled(True)
+        self.verify_btn.setEnabled(True)
+        self.orphans_btn.setEnabled(True)
+        self.duplicates_btn.setEnabled(True)
+        self.restore_btn.setEnabled(True)
         
-        # 更新信息显示
-        total_songs = len(song_list)
-        existing_songs = sum(1 for song in song_list if song['exists'])
+        # 更新信息显示，并把各阶段耗时追加到日志
+        extra = f"各阶段耗时：\n{timings.summary()}"
+        if self.scan_thread.profile_path:
+            extra += f"\n\n性能分析结果：{self.scan_thread.profile_path}"
+        self.update_info_text(title, extra)
+        self.write_timings_log(timings, event='scan', playlist=self.playlist_path, songs_folder=self.songs_folder,
+                               songs=len(song_list), folders=len(self.library.local_folders),
+                               index_hits=self.library.index_hits, index_misses=self.library.index_misses,
+                               executor=self.scan_thread.executor_kind, workers=self.scan_thread.max_workers,
+                               profile=self.scan_thread.profile_path)
+        if self.watch_checkbox.isChecked():
+            self.start_watching()
+            self.resume_watch_updates()
+        if self.metadata_checkbox.isChecked():
+            self.start_metadata_fetch()
+
+    def toggle_metadata_fetch(self, enabled):
+        if enabled:
+            self.start_metadata_fetch()
+
+    def start_metadata_fetch(self):
+        """联网查询当前列表中缺少 ID 的歌曲（已查询过且未过期的 hash 会被跳过）"""
+        if self.metadata_thread is not None and self.metadata_thread.isRunning():
+            return
+        hashes = [song.hash for song in self.song_list if song.hash and not song.cache_id]
+        if not hashes:
+            return
+        self.metadata_thread = MetadataThread(hashes, os.path.join(get_app_dir(), METADATA_CACHE_NAME))
+        self.metadata_thread.batch_resolved.connect(self.on_metadata_batch)
+        self.metadata_thread.finished_signal.connect(self.on_metadata_finished)
+        self.status_label.setText(f"正在联网补全 {len(hashes)} 首歌曲的信息...")
+        self.metadata_thread.start()
+
+    def on_metadata_batch(self, entries):
+        """一批查询结果到达：更新对应的行，并记入 cache_info 供自动刷新时继续使用"""
+        self.cache_info.update(entries)
+        self.song_model.refresh_rows(apply_metadata(self.song_list, entries))
+
+    def on_metadata_finished(self, resolved, not_found, errors):
+        text = f"联网补全完成：查询到 {resolved} 首，BeatSaver 上不存在 {not_found} 首"
+        if errors:
+            text += f"，{len(errors)} 批查询失败"
+            with open("error.log", "a", encoding="utf-8") as logf:
+                logf.write("".join(f"联网补全失败: {error}\n" for error in errors))
+        self.status_label.setText(text)
+
+    def toggle_watch(self, enabled):
+        if enabled and self.library is not None:
+            self.start_watching()
+        elif not enabled:
+            self.stop_watching()
+
+    def start_watching(self):
+        """监视歌曲文件夹（增删子文件夹）、歌单文件和 LocalCache.saver（已积累的变化保留）"""
+        self.remove_watch_paths()
+        # 暂时无法解析的文件夹在扫描/刷新线程中已列出，这里不再读取歌曲目录
+        self.incomplete_folders = set(self.library.incomplete_folders)
+        paths = [self.library.songs_folder, self.playlist_path, os.path.join(get_app_dir(), CACHE_NAME)]
+        paths += [os.path.join(self.library.songs_folder, folder) for folder in self.incomplete_folders]
+        self.watcher.addPaths([path for path in paths if os.path.exists(path)])
+        self.status_label.setText("正在监视文件变化")
+
+    def stop_watching(self):
+        self.remove_watch_paths()
+        self.watch_timer.stop()
+        self.watch_folders = set()
+        self.watch_pending = False
+        self.watch_cache_changed = False
+
+    def remove_watch_paths(self):
+        watched = self.watcher.files() + self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+
+    def unwatch_folders(self, paths):
+        """停止监视即将删除或备份的文件夹（Windows 上被监视的文件夹无法移动或删除）"""
+        paths = set(os.path.normcase(os.path.abspath(path)) for path in paths)
+        watched = [path for path in self.watcher.directories()
+                   if os.path.normcase(os.path.abspath(path)) in paths]
+        if watched:
+            self.watcher.removePaths(watched)
+        self.incomplete_folders -= set(os.path.basename(path) for path in watched)
+
+    def on_watched_dir_changed(self, path):
+        """歌曲文件夹增删子文件夹，或仍在下载的文件夹内容有变化"""
+        if os.path.normcase(os.path.abspath(path)) != os.path.normcase(os.path.abspath(self.library.songs_folder)):
+            self.watch_folders.add(os.path.basename(path))
+        self.schedule_watch_update()
+
+    def on_watched_file_changed(self, path):
+        """歌单或 LocalCache.saver 有变化；原子替换写入后原路径会失去监视，需要重新添加"""
+        if os.path.exists(path) and path not in self.watcher.files():
+            self.watcher.addPath(path)
+        if os.path.normcase(path) == os.path.normcase(os.path.join(get_app_dir(), CACHE_NAME)):
+            self.watch_cache_changed = True
+        self.schedule_watch_update()
+
+    def schedule_watch_update(self):
+        """合并短时间内的连续事件，窗口内没有新事件后再刷新"""
+        self.watch_pending = True
+        self.watch_timer.start()
+
+    def is_busy(self):
+        """扫描、删除、恢复或自动刷新是否正在进行"""
+        return any(thread is not None and thread.isRunning()
+                   for thread in (self.scan_thread, self.delete_thread, self.restore_thread, self.watch_thread))
+
+    def run_watch_update(self):
+        """在后台增量刷新；扫描、删除或上一次刷新进行中时，等其结束后再执行"""
+        if not self.watch_pending or self.library is None or not self.watch_checkbox.isChecked():
+            return
+        if self.is_busy():
+            return  # 结束时会检查 watch_pending
+        cache_path = os.path.join(get_app_dir(), CACHE_NAME)
+        self.watch_thread = SongWatchThread(
+            self.library, self.playlist_path, folders=self.watch_folders,
+            cache_path=cache_path if os.path.exists(cache_path) else None,
+            cache_info=self.cache_info, cache_wanted=self.cache_wanted,
+            cache_changed=self.watch_cache_changed,
+            index_path=os.path.join(get_app_dir(), SCAN_INDEX_NAME),
+            use_cache_index=self.cache_index_checkbox.isChecked(),
+            metadata_path=os.path.join(get_app_dir(), METADATA_CACHE_NAME))
+        self.watch_folders = set()
+        self.watch_pending = False
+        self.watch_cache_changed = False
+        self.watch_thread.status_updated.connect(self.status_label.setText)
+        self.watch_thread.finished_signal.connect(self.on_watch_finished)
+        self.watch_thread.finished.connect(self.resume_watch_updates)  # 刷新失败时也继续处理后续变化
+        self.watch_thread.start()
+
+    def on_watch_finished(self, song_list, incomplete):
+        """用增量刷新结果就地更新列表（保留勾选），并调整对下载中文件夹的监视"""
+        thread = self.watch_thread
+        if self.watch_checkbox.isChecked() and thread.library.songs_folder == self.library.songs_folder:
+            self.library = thread.library
+            self.cache_info, self.cache_wanted = thread.cache_info, thread.cache_wanted
+            if song_list != self.song_list:
+                # 列表没有变化（如本程序自己删除歌曲后）时保留当前的提示信息
+                self.song_list = song_list
+                self.song_model.update_songs(song_list)
+                self.update_info_text("文件有变化，列表已自动更新")
+                self.status_label.setText(f"已自动更新：{len(thread.changed)} 个歌曲文件夹有变化")
+
+            incomplete = set(incomplete)
+            songs_folder = self.library.songs_folder
+            stale = [os.path.join(songs_folder, folder) for folder in self.incomplete_folders - incomplete]
+            added = [os.path.join(songs_folder, folder) for folder in incomplete - self.incomplete_folders]
+            stale = [path for path in stale if path in self.watcher.directories()]
+            if stale:
+                self.watcher.removePaths(stale)
+            if added:
+                self.watcher.addPaths([path for path in added if os.path.isdir(path)])
+            self.incomplete_folders = incomplete
+
+    def resume_watch_updates(self):
+        """扫描、删除或刷新结束后，处理期间积累的文件变化"""
+        if self.watch_pending:
+            self.watch_timer.start()
+
+    def update_info_text(self, title, extra=""):
+        """按当前歌曲列表刷新统计信息"""
+        total_songs = len(self.song_list)
+        existing_songs = sum(1 for song in self.song_list if song.exists)
         missing_songs = total_songs - existing_songs
+        incomplete_songs = sum(1 for song in self.song_list if song.missing_files)
         
-        info_text = f"""扫描完成！
+        info_text = f"""{title}
 总歌曲数：{total_songs}
 存在的歌曲：{existing_songs}
 缺失的歌曲：{missing_songs}
+文件不完整的歌曲：{incomplete_songs}（缺少 info.dat 中引用的难度或音频文件，鼠标悬停可查看）
 
 提示：
 - 绿色：歌曲文件存在
 - 红色：歌曲文件缺失
-- 勾选要删除的歌曲，点击"删除选中歌曲"按钮"""
+- 勾选要删除的歌曲，点击"删除选中歌曲"按钮
+- 删除后列表就地更新，如需与磁盘核对请点击“重新校验”"""
+        if extra:
+            info_text += f"\n\n{extra}"
         
         self.info_text.setText(info_text)
     
+    def write_timings_log(self, timings, **fields):
+        """把各阶段耗时追加到程序同级的 ScanTimings.jsonl"""
+        try:
+            timings.write_log(os.path.join(get_app_dir(), TIMINGS_LOG_NAME), **fields)
+        except OSError as e:
+            self.status_label.setText(f"耗时日志写入失败: {e}")
+
     def update_song_list(self):
         """根据筛选、排序、搜索等条件刷新歌曲列表显示"""
-        self.song_list_widget.clear()
-        filter_mode = self.filter_combo.currentIndex()
-        sort_mode = self.sort_combo.currentIndex()
-        only_missing = self.only_missing_checkbox.isChecked()
-        keyword = self.search_edit.text().strip().lower()
-
-        # 排序
-        song_list = self.song_list.copy()
-        if sort_mode == 1:
-            song_list.sort(key=lambda x: x['name'])
-        elif sort_mode == 2:
-            song_list.sort(key=lambda x: x['name'], reverse=True)
-        elif sort_mode == 3:
-            song_list.sort(key=lambda x: x.get('author', ''))
-        elif sort_mode == 4:
-            song_list.sort(key=lambda x: x.get('author', ''), reverse=True)
-
-        for song in song_list:
-            difficulties = song.get('difficulties', [])
-            show = True
-
-            # 仅显示缺失歌曲
-            if only_missing and song['exists']:
-                continue
-
-            # 筛选条件
-            if filter_mode == 1:
-                show = 'Normal' in difficulties and 'Hard' not in difficulties
-            elif filter_mode == 2:
-                show = 'Hard' in difficulties and 'Normal' not in difficulties
-            elif filter_mode == 3:
-                show = 'Normal' not in difficulties and 'Hard' not in difficulties
-
-            if not show:
-                continue
-
-            # 搜索关键字过滤
-            if keyword:
-                if keyword not in song['name'].lower() and keyword not in song.get('author', '').lower():
-                    continue
-
-            author = song.get('author', '')
-            diff_str = '/'.join(difficulties)
-            cache_id = song.get('cache_id', '')
-            display_text = f"{song['name']}"
-            if author:
-                display_text += f" - {author}"
-            if diff_str:
-                display_text += f" [{diff_str}]"
-            if cache_id:
-                display_text += f" (ID:{cache_id})"
-
-            item = QListWidgetItem()
-            item.setData(Qt.UserRole, song['hash'])  # 关键：存储hash，便于删除时一一对应
-            checkbox = QCheckBox(display_text)
-            if song['exists']:
-                checkbox.setStyleSheet("color: green;")
-            else:
-                checkbox.setStyleSheet("color: red;")
-            desc = song.get('cache_desc', '')
-            if desc:
-                item.setToolTip(desc)
-            self.song_list_widget.addItem(item)
-            self.song_list_widget.setItemWidget(item, checkbox)
-    
+        self.search_timer.stop()
+        timings = StageTimings()
+        with timings.stage('filter') as record:
+            self.song_proxy.set_criteria(
+                self.filter_combo.currentIndex(),
+                self.sort_combo.currentIndex(),
+                self.only_missing_checkbox.isChecked(),
+                self.search_edit.text().strip().lower())
+            record['count'] = len(self.song_proxy.rows)
+        # 耗时只显示在状态栏，不写入 ScanTimings.jsonl（每次输入都写会让日志不断增长）
+        if self.song_list:
+            self.status_label.setText(f"显示 {record['count']}/{len(self.song_list)} 首，"
+                                      f"筛选耗时 {record['seconds'] * 1000:.1f} ms")
+
+    def visible_source_rows(self):
+        """当前列表中显示的歌曲在 self.song_list 中的下标"""
+        return self.song_proxy.rows
+
     def select_all(self):
         """全选所有歌曲"""
-        for i in range(self.song_list_widget.count()):
-            item = self.song_list_widget.item(i)
-            checkbox = self.song_list_widget.itemWidget(item)
-            checkbox.setChecked(True)
+        self.song_model.set_checked(self.visible_source_rows(), True)
     
     def select_none(self):
         """取消全选"""
-        for i in range(self.song_list_widget.count()):
-            item = self.song_list_widget.item(i)
-            checkbox = self.song_list_widget.itemWidget(item)
-            checkbox.setChecked(False)
+        self.song_model.set_checked(self.visible_source_rows(), False)
     
     def delete_selected(self):
         """删除选中的歌曲（包括本地文件夹和歌单信息）"""
-        # 获取选中的歌曲hash
-        selected_hashes = []
-        for i in range(self.song_list_widget.count()):
-            item = self.song_list_widget.item(i)
-            checkbox = self.song_list_widget.itemWidget(item)
-            if checkbox.isChecked():
-                song_hash = item.data(Qt.UserRole)
-                selected_hashes.append(song_hash)
+        # 获取当前显示且勾选的歌曲hash
+        selected_hashes = [self.song_list[row].hash for row in self.visible_source_rows()
+                           if self.song_model.checked[row]]
 
         if not selected_hashes:
             QMessageBox.information(self, "提示", "请先选择要删除的歌曲！")
             return
 
+        # 根据hash查找song对象，确保与显示一一对应
+        selected_hashes = set(selected_hashes)
+        songs_to_delete = [song for song in self.song_list if song.hash in selected_hashes]
+
+        # 检查其它歌单是否也引用了这些歌曲
+        ref_index = self.load_playlist_refs()
+        shared = [song for song in songs_to_delete
+                  if song.exists and ref_index.other_playlists(song.hash, self.playlist_path)]
+        keep_folders = []
+        if shared:
+            lines = []
+            for song in shared[:10]:
+                names = "、".join(os.path.basename(path) for path in ref_index.other_playlists(song.hash, self.playlist_path))
+                lines.append(f"{song.name}（{names}）")
+            more = f"\n……共 {len(shared)} 首" if len(shared) > 10 else ""
+            reply = QMessageBox.question(
+                self, "歌曲被其它歌单引用",
+                f"以下 {len(shared)} 首歌曲还被其它歌单引用：\n" + "\n".join(lines) + more +
+                "\n\n是：只从当前歌单移除，保留歌曲文件夹\n否：仍然删除歌曲文件夹\n取消：不删除",
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+            if reply == QMessageBox.Cancel:
+                return
+            if reply == QMessageBox.Yes:
+                keep_folders = shared
+
         # 确认删除
         reply = QMessageBox.question(
             self, "确认删除", 
@@ -484,71 +1266,370 @@ class BeatSaberPlaylistManager(QMainWindow):
         if reply != QMessageBox.Yes:
             return
 
-        # 根据hash查找song对象，确保与显示一一对应
-        songs_to_delete = [song for song in self.song_list if song['hash'] in selected_hashes]
-
         # 执行删除
-        self.perform_delete(songs_to_delete)
+        self.perform_delete(songs_to_delete, keep_folders=keep_folders)
+
+    def load_playlist_refs(self):
+        """增量更新当前歌单所在目录的歌单反向索引（hash -> 引用它的歌单）"""
+        ref_index = PlaylistRefIndex(os.path.join(get_app_dir(), PLAYLIST_REFS_NAME)).load()
+        ref_index.update([os.path.dirname(os.path.abspath(self.playlist_path))])
+        try:
+            ref_index.save()
+        except OSError as e:
+            self.status_label.setText(f"歌单反向索引保存失败: {e}")
+        return ref_index
+
+    def find_orphans(self):
+        """查找没有被 Playlists 目录中任何歌单引用的歌曲文件夹，并可删除（按备份设置）"""
+        if self.library is None:
+            QMessageBox.information(self, "提示", "请先扫描歌曲！")
+            return
+        ref_index = self.load_playlist_refs()
+        if ref_index.errors:
+            errors = "\n".join(f"{os.path.basename(path)}: {error}" for path, error in ref_index.errors)
+            QMessageBox.warning(self, "歌单读取失败",
+                                f"以下歌单读取失败，无法确定哪些歌曲未被引用：\n{errors}")
+            return
+        # 当前歌单实际匹配到的文件夹（包括按 key、歌名匹配的）和被引用 hash 的 id 都算作被引用
+        try:
+            cache_info = ref_index.referenced_cache_info(
+                os.path.join(get_app_dir(), CACHE_NAME), MetadataCache(os.path.join(get_app_dir(), METADATA_CACHE_NAME)).load(),
+                use_index=self.cache_index_checkbox.isChecked())
+        except Exception as e:
+            QMessageBox.warning(self, "查找孤立歌曲", f"LocalCache.saver 读取失败，无法确定哪些歌曲未被引用：{e}")
+            return
+        orphans = ref_index.find_orphans(self.library, [song.path for song in self.song_list if song.exists], cache_info)
+        if not orphans:
+            QMessageBox.information(self, "查找孤立歌曲", "所有歌曲文件夹都被至少一个歌单引用。")
+            return
+        lines = "\n".join(local['name'] for local in orphans[:20])
+        more = f"\n……共 {len(orphans)} 个" if len(orphans) > 20 else ""
+        self.info_text.setText(f"未被任何歌单引用的歌曲文件夹（{len(orphans)} 个）：\n" +
+                               "\n".join(local['folder'] for local in orphans))
+        reply = QMessageBox.question(
+            self, "查找孤立歌曲",
+            f"有 {len(orphans)} 个歌曲文件夹没有被 {os.path.dirname(self.playlist_path)} 中的任何歌单引用：\n"
+            f"{lines}{more}\n\n是否删除这些文件夹？",
+            QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        songs = [SongRecord.from_local(local) for local in orphans]
+        self.perform_delete(songs, update_playlist=False)
     
-    def perform_delete(self, songs_to_delete):
-        """执行删除操作，并进行备份"""
-        deleted_count = 0
-        error_count = 0
+    def find_duplicate_folders(self):
+        """在后台查找重复的歌曲文件夹"""
+        if self.library is None:
+            QMessageBox.information(self, "提示", "请先扫描歌曲！")
+            return
+        self.duplicates_btn.setEnabled(False)
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(0)
+        self.status_label.setText("正在查找重复的歌曲文件夹...")
+        self.duplicate_thread = DuplicateScanThread(self.library, self.workers_spin.value(),
+                                                    [song.path for song in self.song_list if song.exists])
+        self.duplicate_thread.progress_updated.connect(
+            lambda done, total: self.progress_bar.setValue(int(done / total * 100) if total else 100))
+        self.duplicate_thread.finished_signal.connect(self.on_duplicates_found)
+        self.duplicate_thread.start()
+
+    def on_duplicates_found(self, groups):
+        """显示重复组和可释放空间，确认后删除每组中多余的文件夹（按备份设置）"""
+        self.progress_bar.setVisible(False)
+        self.duplicates_btn.setEnabled(True)
+        if not groups:
+            self.status_label.setText("没有重复的歌曲文件夹")
+            QMessageBox.information(self, "查找重复歌曲", "没有发现重复的歌曲文件夹。")
+            return
+        duplicates = [local for group in groups for local in group['duplicates']]
+        reclaimable = format_size(sum(group['reclaimable'] for group in groups))
+        lines = []
+        for group in groups:
+            lines.append(f"{group['name']}（可释放 {format_size(group['reclaimable'])}）")
+            lines.append(f"  保留：{group['keep']['folder']}")
+            for local in group['duplicates']:
+                same = "（内容完全相同）" if local['folder'] in group['identical'] else ""
+                lines.append(f"  重复：{local['folder']} {format_size(group['sizes'][local['folder']])}{same}")
+        self.info_text.setText(f"重复的歌曲文件夹：{len(groups)} 组，{len(duplicates)} 个，"
+                               f"共可释放 {reclaimable}\n\n" + "\n".join(lines))
+        self.status_label.setText(f"发现 {len(groups)} 组重复歌曲，可释放 {reclaimable}")
+        reply = QMessageBox.question(
+            self, "查找重复歌曲",
+            f"发现 {len(groups)} 组重复歌曲，共 {len(duplicates)} 个多余的文件夹，可释放 {reclaimable}。\n"
+            f"每组保留歌单匹配使用的文件夹，详情见详细信息区。\n\n是否删除多余的文件夹？",
+            QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        songs = [SongRecord.from_local(local) for local in duplicates]
+        self.perform_delete(songs, update_playlist=False)
 
+    def perform_delete(self, songs_to_delete, keep_folders=(), update_playlist=True):
+        """执行删除操作，并进行备份（歌曲文件夹在后台线程中处理）
+
+        keep_folders 中的歌曲只从歌单移除，保留文件夹；update_playlist 为 False 时不修改歌单（删除孤立或重复的文件夹）。
+        """
         # 备份文件夹与程序同级
-        backup_folder = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "backup")
-        os.makedirs(backup_folder, exist_ok=True)
+        backup_folder = os.path.join(get_app_dir(), BACKUP_FOLDER_NAME)
+        backup_enabled = self.backup_checkbox.isChecked()
+        if backup_enabled:
+            os.makedirs(backup_folder, exist_ok=True)
 
-        # 备份歌单文件（只备份一次，已有则不重复备份）
-        playlist_backup_path = os.path.join(backup_folder, os.path.basename(self.playlist_path))
-        if self.backup_checkbox.isChecked() and not os.path.exists(playlist_backup_path):
-            try:
-                shutil.copy2(self.playlist_path, playlist_backup_path)
-            except Exception as e:
-                QMessageBox.warning(self, "备份失败", f"歌单文件备份失败: {str(e)}")
+        # 备份歌单文件（同名备份已存在时自动改名）
+        self.backup_session = None
+        if backup_enabled:
+            self.backup_session = BackupSession(backup_folder, archive=self.archive_combo.currentData())
+            if update_playlist:
+                try:
+                    self.backup_session.backup_file(self.playlist_path)
+                except Exception as e:
+                    QMessageBox.warning(self, "备份失败", f"歌单文件备份失败: {str(e)}")
+
+        # 本地不存在的歌曲和被其它歌单引用而保留的歌曲只需从歌单中移除
+        keep_hashes = set(song.hash for song in keep_folders)
+        self.delete_update_playlist = update_playlist
+        self.playlist_only = [song for song in songs_to_delete if not song.exists or song.hash in keep_hashes]
+        existing = [song for song in songs_to_delete if song.exists and song.hash not in keep_hashes]
+        if self.backup_session:
+            job_func = self.backup_session.backup_and_delete
+        else:
+            job_func = lambda song: shutil.rmtree(song.path)
+
+        self.unwatch_folders([song.path for song in existing])
+        self.delete_thread = FileJobThread(existing, job_func, item_name=lambda song: song.name)
+        self.delete_thread.progress_updated.connect(self.on_delete_progress)
+        self.delete_thread.item_failed.connect(self.on_job_item_failed)
+        self.delete_thread.finished_signal.connect(self.on_delete_finished)
+        self.set_delete_running(True, "取消删除")
+        self.progress_bar.setValue(0)
+        self.status_label.setText(f"正在删除 {len(existing)} 首歌曲...")
+        self.delete_thread.start()
+
+    def set_delete_running(self, running, cancel_text="取消删除"):
+        """删除或恢复进行中显示进度条和取消按钮，并禁用扫描/删除按钮"""
+        self.progress_bar.setVisible(running)
+        self.cancel_btn.setText(cancel_text)
+        self.cancel_btn.setVisible(running)
+        self.cancel_btn.setEnabled(running)
+        self.scan_btn.setEnabled(not running)
+        self.delete_btn.setEnabled(not running)
+        self.verify_btn.setEnabled(not running)
+        self.orphans_btn.setEnabled(not running)
+        self.duplicates_btn.setEnabled(not running)
+        self.restore_btn.setEnabled(not running)
+
+    def cancel_delete(self):
+        """取消正在进行的删除或恢复"""
+        self.cancel_btn.setEnabled(False)
+        self.status_label.setText("正在取消，等待进行中的歌曲处理完成...")
+        for thread in (self.delete_thread, self.restore_thread, self.restore_lookup_thread):
+            if thread is not None and thread.isRunning():
+                thread.cancel()
+
+    def on_job_item_failed(self, name, error):
+        """删除或恢复中某首歌失败时立即显示在详细信息区，完成后汇总在结果提示中"""
+        self.info_text.append(f"失败：{name} - {error}")
 
-        for song in songs_to_delete:
+    def on_delete_progress(self, done, total):
+        self.progress_bar.setValue(int(done / total * 100) if total else 100)
+        self.status_label.setText(f"正在删除... {done}/{total}")
+
+    def on_delete_finished(self, result):
+        """删除完成：更新歌单文件、汇总结果，并就地刷新列表"""
+        self.set_delete_running(False)
+        deleted = result['done']
+        failed = result['failed']
+        if self.backup_session:
             try:
-                if song['exists']:
-                    # 备份歌曲文件夹（已有则不重复备份）
-                    if self.backup_checkbox.isChecked():
-                        backup_path = os.path.join(backup_folder, os.path.basename(song['path']))
-                        if not os.path.exists(backup_path):
-                            shutil.copytree(song['path'], backup_path)
-                    # 删除文件夹
-                    shutil.rmtree(song['path'])
-                    deleted_count += 1
+                self.backup_session.close()
             except Exception as e:
-                error_count += 1
-                print(f"删除失败: {song['name']} - {str(e)}")
+                failed.append((SongRecord("备份清单/归档", '', path=self.backup_session.backup_folder), str(e)))
+
+        # 更新歌单文件，只移除已删除、本就缺失和保留文件夹的歌曲（失败或取消的保留在歌单中）
+        if self.delete_update_playlist:
+            self.update_playlist_file([song.hash for song in deleted + self.playlist_only])
 
-        # 更新歌单文件，移除已删除歌曲
-        self.update_playlist_file([song['hash'] for song in songs_to_delete])
+        summary = f"成功删除：{len(deleted)} 首\n失败：{len(failed)} 首"
+        kept = len(self.playlist_only) - sum(1 for song in self.playlist_only if not song.exists)
+        if kept:
+            summary += f"\n仅从歌单移除（保留文件夹）：{kept} 首"
+        if result['cancelled']:
+            skipped = len(self.delete_thread.items) - len(deleted) - len(failed)
+            summary = f"删除已取消！\n{summary}\n未处理：{skipped} 首"
+        else:
+            summary = f"删除完成！\n{summary}"
+        details = ""
+        if failed:
+            errors = "\n".join(f"{song.name}: {error}" for song, error in failed)
+            details = f"失败详情：\n{errors}"
+            with open("error.log", "a", encoding="utf-8") as logf:
+                logf.write("".join(f"删除失败: {song.path} - {error}\n" for song, error in failed))
+            shown = "\n".join(f"{song.name}: {error}" for song, error in failed[:10])
+            more = f"\n……共 {len(failed)} 条，详见详细信息区" if len(failed) > 10 else ""
+            summary += f"\n\n失败详情：\n{shown}{more}"
+
+        # 就地移除已删除的歌曲，不重新扫描磁盘
+        self.remove_deleted_songs(deleted, self.playlist_only, update_list=self.delete_update_playlist)
+        self.update_info_text(summary.split("\n", 1)[0], details)
 
         # 显示结果
-        QMessageBox.information(
-            self, "删除完成", 
-            f"删除完成！\n成功删除：{deleted_count} 首\n失败：{error_count} 首")
+        QMessageBox.information(self, "删除完成", summary)
+        self.resume_watch_updates()
 
-        # 重新扫描
-        self.scan_songs()
+    def restore_missing(self):
+        """在备份清单中查找列表里缺失的歌曲，确认后在后台并行恢复到歌曲文件夹"""
+        backup_folder = os.path.join(get_app_dir(), BACKUP_FOLDER_NAME)
+        self.restore_lookup_thread = BackupLookupThread(
+            backup_folder, [song.hash for song in self.song_list if not song.exists])
+        self.restore_lookup_thread.progress_updated.connect(self.on_restore_lookup_progress)
+        self.restore_lookup_thread.finished_signal.connect(self.on_restore_lookup_finished)
+        self.set_delete_running(True, "取消查找")
+        self.progress_bar.setValue(0)
+        self.status_label.setText("正在备份中查找缺失的歌曲...")
+        self.restore_lookup_thread.start()
+
+    def on_restore_lookup_progress(self, done, total):
+        self.progress_bar.setValue(int(done / total * 100) if total else 100)
+        self.status_label.setText(f"正在为没有清单记录的旧备份计算 hash... {done}/{total}")
+
+    def on_restore_lookup_finished(self, found, cancelled):
+        """备份查找完成：确认后在后台并行恢复"""
+        self.set_delete_running(False)
+        if cancelled:
+            self.status_label.setText("已取消在备份中查找")
+            return
+        backup_folder = self.restore_lookup_thread.backup_folder
+        self.status_label.setText(f"备份中找到 {len(found)} 首缺失的歌曲")
+        if not found:
+            QMessageBox.information(self, "提示", "备份中没有找到列表里缺失的歌曲。")
+            return
+        entries = list(found.values())
+        lines = "\n".join(entry['name'] for entry in entries[:20])
+        more = f"\n……共 {len(entries)} 首" if len(entries) > 20 else ""
+        reply = QMessageBox.question(
+            self, "从备份恢复",
+            f"备份中找到 {len(entries)} 首缺失的歌曲：\n{lines}{more}\n\n"
+            f"与歌曲文件夹在同一磁盘的备份会直接移回，其余复制或从归档中解压。确定恢复吗？",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        try:
+            self.restore_session = RestoreSession(backup_folder, self.library.songs_folder)
+        except OSError as e:
+            QMessageBox.warning(self, "恢复失败", f"无法访问歌曲文件夹: {str(e)}")
+            return
+        self.restore_summary = ""
+        self.restore_thread = FileJobThread(entries, self.restore_session.restore, item_name=lambda entry: entry['name'])
+        self.restore_thread.progress_updated.connect(self.on_restore_progress)
+        self.restore_thread.item_failed.connect(self.on_job_item_failed)
+        self.restore_thread.finished_signal.connect(self.on_restore_finished)
+        self.set_delete_running(True, "取消恢复")
+        self.progress_bar.setValue(0)
+        self.status_label.setText(f"正在恢复 {len(entries)} 首歌曲...")
+        self.restore_thread.start()
+
+    def on_restore_progress(self, done, total):
+        self.progress_bar.setValue(int(done / total * 100) if total else 100)
+        self.status_label.setText(f"正在恢复... {done}/{total}")
+
+    def on_restore_finished(self, result):
+        """恢复完成：更新备份清单，然后只重新解析恢复出来的文件夹并重新匹配歌单"""
+        self.set_delete_running(False)
+        failed = result['failed']
+        try:
+            self.restore_session.close()
+        except Exception as e:
+            failed.append(({'name': "备份清单"}, str(e)))
+        summary = f"成功恢复：{len(result['done'])} 首\n失败：{len(failed)} 首"
+        if result['cancelled']:
+            skipped = len(self.restore_thread.items) - len(result['done']) - len(failed)
+            summary = f"恢复已取消！\n{summary}\n未处理：{skipped} 首"
+        else:
+            summary = f"恢复完成！\n{summary}"
+        if failed:
+            with open("error.log", "a", encoding="utf-8") as logf:
+                logf.write("".join(f"恢复失败: {entry['name']} - {error}\n" for entry, error in failed))
+            shown = "\n".join(f"{entry['name']}: {error}" for entry, error in failed[:10])
+            more = f"\n……共 {len(failed)} 条，详见 error.log" if len(failed) > 10 else ""
+            summary += f"\n\n失败详情：\n{shown}{more}"
+        self.restore_summary = summary
+
+        restored = [os.path.basename(path) for _, path in self.restore_session.restored]
+        if not restored:
+            self.on_restore_verify_done()
+            return
+        self.status_label.setText(f"正在校验恢复的 {len(restored)} 个歌曲文件夹...")
+        cache_path = os.path.join(get_app_dir(), CACHE_NAME)
+        self.watch_thread = SongWatchThread(
+            self.library, self.playlist_path, folders=restored,
+            cache_path=cache_path if os.path.exists(cache_path) else None,
+            cache_info=self.cache_info, cache_wanted=self.cache_wanted,
+            index_path=os.path.join(get_app_dir(), SCAN_INDEX_NAME),
+            use_cache_index=self.cache_index_checkbox.isChecked(),
+            metadata_path=os.path.join(get_app_dir(), METADATA_CACHE_NAME))
+        self.watch_thread.status_updated.connect(self.status_label.setText)
+        self.watch_thread.finished_signal.connect(self.on_restore_verified)
+        self.watch_thread.finished.connect(self.on_restore_verify_done)
+        self.watch_thread.start()
+
+    def on_restore_verified(self, song_list, incomplete):
+        """用校验结果就地更新列表（保留勾选），统计恢复后确实存在的歌曲"""
+        thread = self.watch_thread
+        self.library = thread.library
+        self.cache_info, self.cache_wanted = thread.cache_info, thread.cache_wanted
+        self.song_list = song_list
+        self.song_model.update_songs(song_list)
+        restored_hashes = set(entry['hash'].lower() for entry, _ in self.restore_session.restored)
+        verified = sum(1 for song in song_list if song.exists and song.hash in restored_hashes)
+        self.restore_summary += f"\n\n校验：恢复的 {len(restored_hashes)} 首中 {verified} 首已在列表中显示为存在"
+
+    def on_restore_verify_done(self):
+        self.update_info_text(self.restore_summary.split("\n", 1)[0], self.restore_summary.split("\n", 1)[1])
+        QMessageBox.information(self, "恢复完成", self.restore_summary)
+        self.resume_watch_updates()
+
+    def remove_deleted_songs(self, deleted, missing, update_list=True):
+        """从歌曲列表和扫描索引中移除已删除的歌曲，并刷新列表（不读取磁盘）
+
+        update_list 为 False 时（删除孤立或重复的文件夹，歌单未修改）只更新歌曲库和扫描索引。
+        """
+        removed_hashes = set(song.hash for song in deleted + missing) if update_list else set()
+        if removed_hashes:
+            self.song_list = [song for song in self.song_list if song.hash not in removed_hashes]
+            self.song_model.set_songs(self.song_list)
+        if self.library is not None and deleted:
+            deleted_paths = set(song.path for song in deleted)
+            self.library.set_folders([local for local in self.library.local_folders
+                                      if local['folder'] not in deleted_paths])
+            # 歌单未修改时仍可能有行指向已删除的文件夹：改为同 hash 的剩余文件夹，没有则标为缺失
+            stale = [song for song in self.song_list if song.exists and song.path in deleted_paths]
+            for song in stale:
+                local = self.library.folder_by_hash.get(song.hash)
+                if local is not None and local['egg_ok']:
+                    song.path, song.author, song.diff_mask = local['folder'], local['author'], local['diff_mask']
+                    song.missing_files = local.get('missing_files', ())
+                else:
+                    song.exists, song.path, song.author, song.diff_mask, song.missing_files = False, '', '', 0, ()
+            if stale:
+                self.song_model.update_songs(self.song_list)
+
+        # 扫描索引中去掉已删除的文件夹，下次扫描无需再确认
+        deleted_folders = [os.path.basename(os.path.normpath(song.path)) for song in deleted]
+        if deleted_folders:
+            scan_index = ScanIndex(os.path.join(get_app_dir(), SCAN_INDEX_NAME)).load()
+            scan_index.remove_folders(ScanIndex.root_key(self.songs_folder), deleted_folders)
+            try:
+                scan_index.save()
+            except OSError as e:
+                self.status_label.setText(f"扫描索引保存失败: {e}")
+                return
+        if update_list:
+            self.status_label.setText(f"已从列表中移除 {len(removed_hashes)} 首歌曲")
+        else:
+            self.status_label.setText(f"已删除 {len(deleted)} 个歌曲文件夹")
     
     def update_playlist_file(self, deleted_hashes):
-        """更新歌单文件，移除已删除歌曲，并保存到原歌单文件"""
+        """更新歌单文件，移除已删除歌曲（hash 不区分大小写），写入临时文件后原子替换原歌单文件"""
         try:
-            with open(self.playlist_path, 'r', encoding='utf-8') as f:
-                playlist_data = json.load(f)
-            
-            # 移除已删除的歌曲
-            original_songs = playlist_data.get('songs', [])
-            updated_songs = [song for song in original_songs if song.get('hash') not in deleted_hashes]
-            
-            playlist_data['songs'] = updated_songs
-            
-            # 保存更新后的歌单
-            with open(self.playlist_path, 'w', encoding='utf-8') as f:
-                json.dump(playlist_data, f, indent=2, ensure_ascii=False)
-                
+            remove_playlist_entries(self.playlist_path, deleted_hashes)
         except Exception as e:
             QMessageBox.warning(self, "错误", f"操作失败: {str(e)}")
             # 可选：写入日志文件
@@ -557,10 +1638,18 @@ class BeatSaberPlaylistManager(QMainWindow):
 
 def main():
     """程序入口"""
-    app = QApplication(sys.argv)
-    app.setApplicationName("Beat Saber 歌单管理器")
+    freeze_support()  # 打包为 exe 时进程池需要
+    timings = StageTimings()  # 启动各阶段耗时，首次绘制后追加到 ScanTimings.jsonl
+    timings.add('imports', time.perf_counter() - STARTUP_CLOCK)
+    with timings.stage('qt_init'):
+        app = QApplication(sys.argv)
+        app.setApplicationName("Beat Saber 歌单管理器")
     
-    window = BeatSaberPlaylistManager()
+    with timings.stage('window'):
+        window = BeatSaberPlaylistManager()
+    with timings.stage('session') as record:
+        record['count'] = window.restore_session()
+    window.startup_timings = timings
     window.show()
     
     sys.exit(app.exec_())
@@ -0,0 +1,54 @@
+"""歌单匹配微基准：验证 match_playlist_songs 的耗时随歌单条目数和文件夹数线性增长
+
+用法：python benchmarks/bench_match.py [基础规模]
+每一档规模翻倍，若匹配是线性的，“每条耗时”一列应基本保持不变。
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from playlist_engine import SongLibrary, match_playlist_songs  # noqa: E402
+
+
+def make_data(n_songs):
+    """生成 n_songs 个歌单条目和 4 倍数量的本地文件夹信息，混合 hash 匹配、歌名回退和同名条目"""
+    songs = []
+    local_folders = []
+    for i in range(n_songs * 4):
+        name = f"Song {i}"
+        local_folders.append({
+            'folder': os.path.join('CustomLevels', f"{i:x} ({name} - mapper)"),
+            'name': name,
+            'author': f"Author {i % 97}",
+            'difficulties': ['Normal', 'Hard'],
+            'egg_ok': True,
+            'hash': f"{i:040x}",
+        })
+    for i in range(n_songs):
+        # 歌单条目隔一个取一个：偶数条目按 hash 匹配，奇数条目 hash 对不上、回退到歌名匹配
+        song_hash = f"{i * 2:040x}" if i % 2 == 0 else f"{i:039x}f"
+        songs.append({'songName': f"Song {i * 2}", 'hash': song_hash})
+    songs.append({'songName': "Song 0", 'hash': f"{n_songs:039x}f"})
+    return songs, local_folders
+
+
+def main():
+    base = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"{'歌单条目':>8} {'文件夹':>8} {'耗时(ms)':>10} {'每条(us)':>10}")
+    for factor in (1, 2, 4, 8):
+        songs, local_folders = make_data(base * factor)
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            # 计时包含建立文件夹索引和匹配两部分
+            library = SongLibrary('CustomLevels', local_folders)
+            match_playlist_songs(songs, library, {})
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        total = len(songs) + len(local_folders)
+        print(f"{len(songs):>8} {len(local_folders):>8} {best * 1000:>10.2f} {best / total * 1e6:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
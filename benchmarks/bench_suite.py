@@ -0,0 +1,247 @@
+"""扫描、筛选和删除/备份的基准测试套件，结果写成 JSON，可在两次运行之间比较
+
+用法：
+    python benchmarks/bench_suite.py run [--sizes 1000 10000 50000] [--workdir 目录] [--repeat 3] [-o 结果.json]
+    python benchmarks/bench_suite.py compare 旧结果.json 新结果.json [--threshold 0.1]
+
+run 用 make_library.py 在 workdir 中为每档规模生成（或复用）合成歌曲库，然后计时：
+    pipeline_cold / pipeline_warm  与 FileProcessThread.run 相同的完整流程（读歌单、读缓存、扫描、匹配），
+                                   cold 为没有扫描索引和缓存索引，warm 为索引已存在
+    scan_cold / scan_warm          只扫描歌曲文件夹
+    cache_cold / cache_warm        只读取 LocalCache.saver（有无旁路索引）
+    match                          歌单匹配
+    filter_*                       列表筛选（与 update_song_list 使用同一个 SongSearchIndex）
+    delete_* / playlist_rewrite    删除 --delete-count 个歌曲文件夹（直接删除、移动备份、跨盘复制、zip 归档）
+                                   以及从歌单中移除对应条目
+“冷”只表示没有索引，操作系统的文件缓存不会被清空。50000 首的合成库约占 2 GB 磁盘空间。
+compare 按 (规模, 测试项) 比较两次结果的最好成绩，变慢超过阈值时返回非零退出码（耗时不足 --min-ms 的项不参与判断）。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from playlist_engine import (FILE_JOB_WORKERS, CACHE_INDEX_SUFFIX, SongLibrary, SongSearchIndex,  # noqa: E402
+                             SongRecord, BackupSession, read_playlist, load_cache_info, remove_playlist_entries)
+from make_library import make_library, make_song_folder  # noqa: E402
+
+
+def timed(func, repeat, setup=None):
+    """执行 repeat 次，返回每次耗时（秒）；setup 在每次计时前执行，不计入耗时"""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def run_pipeline(paths, index_path, max_workers=None):
+    """与 FileProcessThread.run 相同的流程，返回歌曲信息列表"""
+    songs = read_playlist(paths['playlist']).get('songs', [])
+    wanted_hashes = set(song.get('hash', '').lower() for song in songs)
+    cache_info = load_cache_info(paths['cache'], wanted_hashes)
+    library = SongLibrary(paths['songs']).scan(index_path=index_path, max_workers=max_workers)
+    return library.match(songs, cache_info)
+
+
+def bench_scan(paths, work, repeat, max_workers):
+    """完整流程、扫描、缓存读取和匹配"""
+    index_path = os.path.join(work, 'ScanIndex.json')
+    cache_index = paths['cache'] + CACHE_INDEX_SUFFIX
+    songs = read_playlist(paths['playlist']).get('songs', [])
+    wanted_hashes = set(song.get('hash', '').lower() for song in songs)
+    results = {}
+
+    def cold_setup():
+        remove_file(index_path)
+        remove_file(cache_index)
+
+    results['pipeline_cold'] = timed(lambda: run_pipeline(paths, index_path, max_workers), repeat, cold_setup)
+    results['pipeline_warm'] = timed(lambda: run_pipeline(paths, index_path, max_workers), repeat)
+    results['scan_cold'] = timed(
+        lambda: SongLibrary(paths['songs']).scan(index_path=index_path, max_workers=max_workers),
+        repeat, lambda: remove_file(index_path))
+    results['scan_warm'] = timed(
+        lambda: SongLibrary(paths['songs']).scan(index_path=index_path, max_workers=max_workers), repeat)
+    results['cache_cold'] = timed(lambda: load_cache_info(paths['cache'], wanted_hashes), repeat,
+                                  lambda: remove_file(cache_index))
+    results['cache_warm'] = timed(lambda: load_cache_info(paths['cache'], wanted_hashes), repeat)
+    library = SongLibrary(paths['songs']).scan(index_path=index_path, max_workers=max_workers)
+    cache_info = load_cache_info(paths['cache'], wanted_hashes)
+    results['match'] = timed(lambda: library.match(songs, cache_info), repeat)
+    return results, library.match(songs, cache_info)
+
+
+def bench_filter(song_list, repeat):
+    """搜索索引建立和各种筛选条件；关键字按逐字输入的顺序依次查询"""
+    results = {'filter_index_build': timed(lambda: SongSearchIndex(song_list), repeat)}
+    cases = {
+        'filter_all': [(0, 0, False, '')],
+        'filter_mode': [(1, 0, False, ''), (2, 0, False, ''), (3, 0, False, '')],
+        'filter_sort_name': [(0, 1, False, ''), (0, 2, False, '')],
+        'filter_only_missing': [(0, 0, True, '')],
+        'filter_keyword': [(0, 0, False, 'song 1'[:i]) for i in range(1, 7)],
+    }
+    for case, queries in cases.items():
+        def run():
+            index = SongSearchIndex(song_list)
+            start = time.perf_counter()
+            for query in queries:
+                index.search(*query)
+            return time.perf_counter() - start
+        # 只计查询耗时，索引建立单独计时
+        results[case] = [run() for _ in range(repeat)]
+    return results
+
+
+def bench_delete(paths, work, repeat, delete_count):
+    """删除/备份 delete_count 个新生成的歌曲文件夹，以及从歌单中移除同样数量的条目"""
+    victims_dir = os.path.join(work, 'victims')
+    backup_dir = os.path.join(work, 'backup')
+    results = {}
+    victims = []
+
+    def setup():
+        # 每次计时前重新生成要删除的文件夹（不计入耗时）
+        for path in (victims_dir, backup_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.makedirs(backup_dir)
+        rnd = random.Random(2)
+        victims[:] = []
+        for i in range(delete_count):
+            folder = os.path.join(victims_dir, f"victim {i}")
+            name, level_hash = make_song_folder(folder, i, rnd)
+            victims.append(SongRecord(name, level_hash, True, folder))
+
+    def run_jobs(job_func):
+        # 与 FileJobThread 相同的有界线程池
+        with ThreadPoolExecutor(max_workers=FILE_JOB_WORKERS) as executor:
+            list(executor.map(job_func, victims))
+
+    def backup_job(archive=None, cross_device=False):
+        session = BackupSession(backup_dir, archive=archive)
+        if cross_device:
+            session._backup_dev = None  # 模拟备份目录在另一块磁盘上
+        run_jobs(session.backup_and_delete)
+        session.close()
+
+    results['delete_rmtree'] = timed(lambda: run_jobs(lambda song: shutil.rmtree(song.path)), repeat, setup)
+    results['delete_backup_move'] = timed(backup_job, repeat, setup)
+    results['delete_backup_copy'] = timed(lambda: backup_job(cross_device=True), repeat, setup)
+    results['delete_backup_zip'] = timed(lambda: backup_job('zip', cross_device=True), repeat, setup)
+
+    playlist_copy = os.path.join(work, 'bench.bplist')
+    hashes = [song['hash'] for song in read_playlist(paths['playlist'])['songs'][:delete_count]]
+    results['playlist_rewrite'] = timed(lambda: remove_playlist_entries(playlist_copy, hashes), repeat,
+                                        lambda: shutil.copyfile(paths['playlist'], playlist_copy))
+    for path in (victims_dir, backup_dir):
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(args):
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+            'delete_count': args.delete_count,
+        },
+        'results': [],
+    }
+    for size in args.sizes:
+        root = os.path.join(args.workdir, f"lib-{size}")
+        print(f"[{size}] 准备合成歌曲库：{root}", file=sys.stderr)
+        paths = make_library(root, size)
+        work = os.path.join(args.workdir, f"work-{size}")
+        os.makedirs(work, exist_ok=True)
+
+        results, song_list = bench_scan(paths, work, args.repeat, args.workers)
+        results.update(bench_filter(song_list, args.repeat))
+        results.update(bench_delete(paths, work, args.repeat, args.delete_count))
+        for case, runs in results.items():
+            report['results'].append({'size': size, 'case': case, 'best': min(runs),
+                                      'median': statistics.median(runs), 'runs': runs})
+            print(f"{size:>7} {case:<22} 最好 {min(runs) * 1000:>10.2f} ms  中位 {statistics.median(runs) * 1000:>10.2f} ms")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"结果已写入 {args.output}", file=sys.stderr)
+    return 0
+
+
+def compare(args):
+    with open(args.old, 'r', encoding='utf-8') as f:
+        old = {(item['size'], item['case']): item for item in json.load(f)['results']}
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = {(item['size'], item['case']): item for item in json.load(f)['results']}
+    regressions = 0
+    print(f"{'规模':>7} {'测试项':<22} {'旧(ms)':>10} {'新(ms)':>10} {'比值':>7}")
+    for key in sorted(set(old) & set(new)):
+        old_best, new_best = old[key]['best'], new[key]['best']
+        ratio = new_best / old_best if old_best else float('inf')
+        mark = ""
+        if max(old_best, new_best) * 1000 < args.min_ms:
+            pass  # 耗时太短，差异主要是计时噪声
+        elif ratio > 1 + args.threshold:
+            mark = "  变慢"
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            mark = "  变快"
+        print(f"{key[0]:>7} {key[1]:<22} {old_best * 1000:>10.2f} {new_best * 1000:>10.2f} {ratio:>7.2f}{mark}")
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key[0]:>7} {key[1]:<22} 只出现在{'旧' if key in old else '新'}结果中")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="扫描/筛选/删除基准测试")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help="运行基准测试并写入 JSON 结果")
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help="歌曲库规模")
+    run_parser.add_argument('--workdir', default=os.path.join(BENCH_DIR, 'data'),
+                            help="合成歌曲库和临时文件所在目录（生成的歌曲库会被复用）")
+    run_parser.add_argument('--repeat', type=int, default=3, help="每项重复次数")
+    run_parser.add_argument('--delete-count', type=int, default=100, help="删除/备份测试的歌曲文件夹数")
+    run_parser.add_argument('--workers', type=int, default=None, help="扫描并行数")
+    run_parser.add_argument('--output', '-o', default='bench_results.json', help="结果文件")
+    compare_parser = sub.add_parser('compare', help="比较两次结果")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help="视为变快/变慢的相对变化")
+    compare_parser.add_argument('--min-ms', type=float, default=1.0, help="新旧耗时都低于此值（毫秒）的测试项不判断快慢")
+    args = parser.parse_args()
+    return run(args) if args.command == 'run' else compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
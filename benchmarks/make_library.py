@@ -0,0 +1,143 @@
+"""合成歌曲库生成器：生成 CustomLevels 歌曲文件夹、对应的 .bplist 歌单和 LocalCache.saver
+
+用法：python benchmarks/make_library.py 输出目录 歌曲数 [--missing 0.05] [--cache-extra 1.0] [--egg-kb 4]
+
+输出目录下生成：
+    CustomLevels/  每首歌一个 "key (歌名 - mapper)" 文件夹，含 info.dat、难度文件、song.egg 和 cover.jpg
+    Playlists/bench.bplist  引用全部歌曲，另加 missing 比例的本地缺失条目
+    LocalCache.saver  覆盖全部歌曲，另加 cache_extra 倍数量的无关条目（模拟完整的 BeatSaver 缓存）
+同一组参数生成的内容完全相同（固定随机种子），可在多次测试之间复用。
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+
+DIFFICULTIES = ['Easy', 'Normal', 'Hard', 'Expert', 'ExpertPlus']
+CHARACTERISTICS = ['Standard', 'OneSaber', 'NoArrows']
+PARAMS_NAME = "library.json"  # 记录生成参数，参数相同时跳过重新生成；也是本工具生成的目录的标记
+
+
+def make_song_folder(folder, index, rnd, egg_bytes=4 * 1024):
+    """生成一个歌曲文件夹，返回 (歌名, 谱面 hash)"""
+    name = f"Song {index}"
+    sets = []
+    beatmap_files = []
+    for characteristic in CHARACTERISTICS[:rnd.randint(1, len(CHARACTERISTICS))]:
+        diffs = sorted(rnd.sample(DIFFICULTIES, rnd.randint(1, len(DIFFICULTIES))), key=DIFFICULTIES.index)
+        beatmaps = [{'_difficulty': diff, '_difficultyRank': DIFFICULTIES.index(diff) * 2 + 1,
+                     '_beatmapFilename': f"{diff}{characteristic}.dat"} for diff in diffs]
+        beatmap_files += [beatmap['_beatmapFilename'] for beatmap in beatmaps]
+        sets.append({'_beatmapCharacteristicName': characteristic, '_difficultyBeatmaps': beatmaps})
+    info = {
+        '_version': '2.0.0',
+        '_songName': name,
+        '_songSubName': '',
+        '_songAuthorName': f"Author {index % 997}",
+        '_levelAuthorName': 'mapper',
+        '_beatsPerMinute': 60 + index % 180,
+        '_songFilename': 'song.egg',
+        '_coverImageFilename': 'cover.jpg',
+        '_difficultyBeatmapSets': sets,
+    }
+    os.makedirs(folder)
+    info_bytes = json.dumps(info, indent=2).encode('utf-8')
+    with open(os.path.join(folder, 'info.dat'), 'wb') as f:
+        f.write(info_bytes)
+    sha1 = hashlib.sha1(info_bytes)
+    for filename in beatmap_files:
+        notes = [{'_time': t, '_lineIndex': t % 4, '_lineLayer': t % 3, '_type': t % 2, '_cutDirection': t % 8}
+                 for t in range(rnd.randint(20, 100))]
+        data = json.dumps({'_version': '2.0.0', '_notes': notes, '_obstacles': [], '_events': []}).encode('utf-8')
+        with open(os.path.join(folder, filename), 'wb') as f:
+            f.write(data)
+        sha1.update(data)
+    with open(os.path.join(folder, 'song.egg'), 'wb') as f:
+        f.write(rnd.randbytes(egg_bytes))
+    with open(os.path.join(folder, 'cover.jpg'), 'wb') as f:
+        f.write(rnd.randbytes(4096))
+    return name, sha1.hexdigest()
+
+
+def make_library(root, n_songs, missing=0.05, cache_extra=1.0, egg_kb=4, seed=1):
+    """在 root 下生成合成歌曲库，返回 {'songs', 'playlist', 'cache'} 路径；参数相同且已生成时直接复用
+
+    只覆盖空目录或带有 library.json 标记（本工具生成）的目录，其它已存在的路径抛出 FileExistsError，
+    避免误删真实的游戏目录。
+    """
+    params = {'n_songs': n_songs, 'missing': missing, 'cache_extra': cache_extra, 'egg_kb': egg_kb, 'seed': seed}
+    paths = {
+        'songs': os.path.join(root, 'CustomLevels'),
+        'playlist': os.path.join(root, 'Playlists', 'bench.bplist'),
+        'cache': os.path.join(root, 'LocalCache.saver'),
+    }
+    params_path = os.path.join(root, PARAMS_NAME)
+    generated = True  # 标记文件存在（内容损坏也算）
+    try:
+        with open(params_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == params:
+                return paths
+    except ValueError:
+        pass
+    except OSError:
+        generated = False
+    if os.path.exists(root):
+        if not generated and (not os.path.isdir(root) or os.listdir(root)):
+            raise FileExistsError(f"{root} 不是本工具生成的歌曲库（没有 {PARAMS_NAME}），拒绝覆盖")
+        shutil.rmtree(root)
+    os.makedirs(paths['songs'])
+    # 先写入未完成的标记，生成中断后仍能识别并覆盖这个目录
+    with open(params_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(params, complete=False), f)
+    os.makedirs(os.path.dirname(paths['playlist']))
+
+    rnd = random.Random(seed)
+    entries = []
+    docs = []
+    for i in range(n_songs):
+        key = format(i + 0x1000, 'x')
+        name, level_hash = make_song_folder(os.path.join(paths['songs'], f"{key} (Song {i} - mapper)"),
+                                            i, rnd, egg_kb * 1024)
+        entries.append({'key': key, 'hash': level_hash.upper(), 'songName': name, 'levelAuthorName': 'mapper'})
+        docs.append({'id': key, 'name': name, 'description': f"Synthetic map {i} 合成谱面",
+                     'uploader': {'name': 'mapper'}, 'versions': [{'hash': level_hash, 'key': key}]})
+    for i in range(int(n_songs * missing)):
+        level_hash = hashlib.sha1(f"missing {i}".encode()).hexdigest()
+        entries.append({'key': format(0x900000 + i, 'x'), 'hash': level_hash, 'songName': f"Missing {i}"})
+    for i in range(int(n_songs * cache_extra)):
+        level_hash = hashlib.sha1(f"extra {i}".encode()).hexdigest()
+        docs.append({'id': format(0xa00000 + i, 'x'), 'name': f"Extra {i}", 'description': 'x' * 200,
+                     'uploader': {'name': 'someone'}, 'versions': [{'hash': level_hash}]})
+    rnd.shuffle(docs)
+
+    with open(paths['playlist'], 'w', encoding='utf-8') as f:
+        json.dump({'playlistTitle': f"Bench {n_songs}", 'playlistAuthor': 'bench', 'songs': entries},
+                  f, indent=2, ensure_ascii=False)
+    with open(paths['cache'], 'w', encoding='utf-8') as f:
+        json.dump({'docs': docs}, f, ensure_ascii=False)
+    with open(params_path, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成的 Beat Saber 歌曲库")
+    parser.add_argument('root', help="输出目录（只覆盖空目录或本工具生成的目录）")
+    parser.add_argument('n_songs', type=int, help="歌曲文件夹数")
+    parser.add_argument('--missing', type=float, default=0.05, help="歌单中本地缺失条目的比例")
+    parser.add_argument('--cache-extra', type=float, default=1.0, help="LocalCache.saver 中无关条目相对歌曲数的倍数")
+    parser.add_argument('--egg-kb', type=int, default=4, help="每个 song.egg 的大小（KB）")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    try:
+        paths = make_library(args.root, args.n_songs, args.missing, args.cache_extra, args.egg_kb, args.seed)
+    except FileExistsError as e:
+        parser.error(str(e))
+    for name, path in paths.items():
+        print(f"{name}: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2192 @@
+"""Beat Saber 歌单同步的扫描引擎，不依赖 PyQt5，可被图形界面和命令行共同使用
+
+包含歌曲文件夹扫描（扫描索引、并行解析、谱面 hash）、LocalCache.saver 流式读取、
+歌单匹配、备份和搜索索引等逻辑。直接运行本文件即为命令行工具：
+
+    python playlist_engine.py scan   --songs CustomLevels --playlists Playlists
+    python playlist_engine.py report --songs CustomLevels --playlists Playlists --format csv -o report.csv
+    python playlist_engine.py prune  --songs CustomLevels --playlist a.bplist b.bplist --dry-run
+    python playlist_engine.py orphans --songs CustomLevels --playlists Playlists
+    python playlist_engine.py duplicates --songs CustomLevels --playlists Playlists
+    python playlist_engine.py restore --songs CustomLevels --playlists Playlists --dry-run
+"""
+import contextlib
+import hashlib
+import json
+import operator
+import os
+import re
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+# asyncio/http.client（联网查询）、zipfile/tarfile（归档）、进程池和 argparse/csv（命令行）在用到的地方才导入，
+# 图形界面启动时不加载
+try:
+    import zstandard  # 可选依赖，安装后可使用 tar.zst 归档备份
+except ImportError:
+    zstandard = None
+
+SCAN_INDEX_NAME = "ScanIndex.json"  # 扫描索引文件名，与程序同级
+HASH_CHUNK_SIZE = 1024 * 1024       # 计算谱面 hash 时每次读取的字节数
+CACHE_CHUNK_SIZE = 1024 * 1024      # 流式读取 LocalCache.saver 时每次读取的字符数
+CACHE_INDEX_SUFFIX = ".idx"         # LocalCache.saver 旁路索引文件后缀
+FILE_JOB_WORKERS = 4                # 删除/备份等文件操作的并行线程数（有界，避免磁盘过载）
+BACKUP_MANIFEST_NAME = "manifest.json"  # 备份清单文件名，位于 backup 文件夹中
+BACKUP_FOLDER_NAME = "backup"       # 备份文件夹名，与程序同级
+CACHE_NAME = "LocalCache.saver"     # BeatSaver 缓存文件名，与程序同级
+PLAYLIST_EXTENSIONS = ('.bplist', '.json')  # 歌单文件扩展名
+PLAYLIST_REFS_NAME = "PlaylistRefs.json"    # 歌单反向索引文件名，与程序同级
+COMPACT_PLAYLIST_SONGS = 2000       # compact='auto' 时，歌曲数达到此值的歌单写成紧凑 JSON
+TIMINGS_LOG_NAME = "ScanTimings.jsonl"  # 各阶段耗时日志（每行一条 JSON），与程序同级
+METADATA_CACHE_NAME = "BeatSaverCache.json"  # 联网查询到的歌曲信息缓存，与程序同级
+BEATSAVER_API = os.environ.get('BEATSAVER_API', "https://api.beatsaver.com")  # BeatSaver API 地址，可用环境变量覆盖
+METADATA_BATCH_SIZE = 50            # 每个请求查询的 hash 数（BeatSaver 批量查询上限）
+METADATA_CONCURRENCY = 4            # 同时进行的请求数，也是保持复用的连接数
+METADATA_TTL = 30 * 24 * 3600       # 查询到的信息的有效期（秒）
+METADATA_MISS_TTL = 24 * 3600       # BeatSaver 上不存在的 hash 的有效期（秒），过期后重新查询
+METADATA_CACHE_MAX = 50000          # 缓存最多保留的条目数，超出时丢弃最早查询的条目
+SESSION_NAME = "Session.json"       # 上次使用的歌单、歌曲文件夹和筛选/排序等界面状态，与程序同级
+SCAN_SNAPSHOT_NAME = "ScanSnapshot.json"  # 上次的歌曲列表快照，启动时直接显示，与程序同级
+
+
+def get_app_dir():
+    """程序所在目录（LocalCache.saver、backup、扫描索引等文件均与程序同级）"""
+    return os.path.dirname(os.path.abspath(sys.argv[0]))
+
+
+class StageTimings:
+    """记录扫描各阶段的耗时、处理数量和读取字节数，用于判断慢在哪一步
+
+    用法：with timings.stage('walk') as record: ...; record['count'] += 1
+    """
+
+    def __init__(self):
+        self.stages = []  # [{'stage', 'seconds', 'count', 'bytes'}, ...]，按完成顺序
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = {'stage': name, 'seconds': 0.0, 'count': 0, 'bytes': 0}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self.stages.append(record)
+
+    def add(self, name, seconds, count=0):
+        """记录在 stage() 之外测得的阶段（如跨越事件循环的启动到首次绘制）"""
+        self.stages.append({'stage': name, 'seconds': seconds, 'count': count, 'bytes': 0})
+
+    def total_seconds(self):
+        return sum(record['seconds'] for record in self.stages)
+
+    def summary(self):
+        """生成多行文本：每个阶段的耗时、数量和读取量"""
+        lines = [f"{'阶段':<14}{'耗时(ms)':>10}{'数量':>9}  读取"]
+        for record in self.stages:
+            size = format_size(record['bytes']) if record['bytes'] else "-"
+            lines.append(f"{record['stage']:<16}{record['seconds'] * 1000:>10.1f}{record['count']:>10}  {size}")
+        lines.append(f"{'合计':<14}{self.total_seconds() * 1000:>10.1f}")
+        return "\n".join(lines)
+
+    def write_log(self, log_path, **fields):
+        """以一行 JSON 追加到日志文件，fields 为附加信息（如歌单路径、歌曲数）"""
+        record = dict(fields, time=time.strftime('%Y-%m-%d %H:%M:%S'),
+                      total_seconds=round(self.total_seconds(), 6),
+                      stages=[dict(stage, seconds=round(stage['seconds'], 6)) for stage in self.stages])
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def list_folder_files(folder_path, names=None):
+    """读取一次目录，返回 (文件名集合, 小写文件名 -> 文件名)；文件类型来自目录项本身，不需要逐个 stat
+
+    names 为已经读到的文件名列表（如 song_folder_sig 的结果）时直接使用，不再读取目录。
+    """
+    if names is None:
+        with os.scandir(folder_path) as entries:
+            names = [entry.name for entry in entries if entry.is_file()]
+    return set(names), {name.lower(): name for name in names}
+
+
+def find_folder_file(names, lower_names, filename):
+    """在 list_folder_files 的结果中查找文件，大小写不一致时（Windows 上同样能打开）按小写匹配"""
+    if filename in names:
+        return filename
+    return lower_names.get(filename.lower())
+
+
+def parse_song_folder(folder_path, counter=None, names=None):
+    """解析单个歌曲文件夹的 info.dat，返回歌名、作者、难度列表、是否有.egg文件以及谱面 hash
+
+    文件夹只读取一次目录：info.dat、.egg 和 info.dat 中引用的各难度文件、音频文件是否存在都从同一份
+    文件列表判断，缺少的文件记录在 missing_files 中，对应的难度不计入难度列表。
+    counter 为单元素列表时，读取的字节数累加到 counter[0]。
+    names 为计算签名时已读到的文件名列表时不再读取目录（见 list_folder_files）。
+    """
+    names, lower_names = list_folder_files(folder_path, names)
+    info_name = find_folder_file(names, lower_names, 'info.dat')
+    if info_name is None:
+        raise FileNotFoundError(os.path.join(folder_path, 'info.dat'))
+    with open(os.path.join(folder_path, info_name), 'rb') as f:
+        info_bytes = f.read()
+    if counter is not None:
+        counter[0] += len(info_bytes)
+    info = json.loads(info_bytes)
+    # 获取所有实际存在的难度，以及按顺序排列的难度文件（用于计算 hash）
+    difficulties = []
+    beatmap_files = []
+    missing_files = []
+    for dset in info.get('_difficultyBeatmapSets', []):
+        for diff in dset.get('_difficultyBeatmaps', []):
+            filename = diff.get('_beatmapFilename', '')
+            found = find_folder_file(names, lower_names, filename) if filename else None
+            beatmap_files.append(found)
+            if found is None:
+                if filename and filename not in missing_files:
+                    missing_files.append(filename)
+                continue
+            diff_name = diff.get('_difficulty')
+            if diff_name and diff_name not in difficulties:
+                difficulties.append(diff_name)
+    song_filename = info.get('_songFilename')
+    if song_filename and find_folder_file(names, lower_names, song_filename) is None:
+        missing_files.append(song_filename)
+    # 检查是否有.egg文件
+    egg_ok = any(name.endswith('.egg') for name in names)
+    return {
+        'name': info.get('_songName', ''),
+        'author': info.get('_songAuthorName', ''),
+        'difficulties': difficulties,
+        'egg_ok': egg_ok,
+        'missing_files': missing_files,
+        # 缺少难度文件时无法得到标准 hash，不必再逐个尝试打开
+        'hash': '' if None in beatmap_files else compute_level_hash(folder_path, info_bytes, beatmap_files, counter),
+    }
+
+
+def compute_level_hash(folder_path, info_bytes, beatmap_files, counter=None):
+    """计算 Beat Saber 标准谱面 hash：info.dat 内容后依次接上各难度文件内容的 SHA-1（小写）
+
+    难度文件按块流式读取，不会一次性载入内存；任一难度文件无法读取时返回空字符串。
+    """
+    sha1 = hashlib.sha1(info_bytes)
+    try:
+        for filename in beatmap_files:
+            with open(os.path.join(folder_path, filename), 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    sha1.update(chunk)
+                    if counter is not None:
+                        counter[0] += len(chunk)
+    except OSError:
+        return ''
+    return sha1.hexdigest()
+
+
+def parse_song_folder_safe(folder_path, names=None):
+    """parse_song_folder 的容错版本，解析失败返回 None（供线程池/进程池调用）"""
+    try:
+        return parse_song_folder(folder_path, names=names)
+    except Exception:
+        return None
+
+
+def song_folder_incomplete(local_info):
+    """解析结果是否说明文件夹还没写全：解析失败、没有 .egg、缺少引用的文件或算不出 hash
+
+    下载解压时 info.dat 可能先于 song.egg 和难度文件出现，这样的文件夹需要继续监视，直到完整解析。
+    """
+    return (local_info is None or not local_info['egg_ok'] or bool(local_info['missing_files'])
+            or not local_info['hash'])
+
+
+def parse_song_folder_counted(folder_path, names=None):
+    """parse_song_folder_safe 的带统计版本，返回 (解析结果或 None, 读取的字节数)"""
+    counter = [0]
+    try:
+        return parse_song_folder(folder_path, counter, names), counter[0]
+    except Exception:
+        return None, counter[0]
+
+
+def list_song_dirs(songs_folder):
+    """读取一次歌曲根目录，返回 {文件夹名: DirEntry}（只含子文件夹）
+
+    是否为文件夹由目录项自带的类型判断；DirEntry.stat() 在 Windows 上直接使用目录项中的时间，无需再访问文件夹。
+    """
+    with os.scandir(songs_folder) as entries:
+        return {entry.name: entry for entry in entries if entry.is_dir()}
+
+
+def song_folder_sig(entry):
+    """读取一次文件夹，返回 (签名, 文件名列表)，没有 info.dat 时抛出 OSError
+
+    签名为 [文件夹 mtime, [[.dat 文件名, mtime, 大小], ...]]；文件名列表可传给 parse_song_folder，
+    需要解析的文件夹因此也只读取一次目录。
+
+    info.dat 和各难度文件（计算谱面 hash 的全部输入）都是 .dat 文件，原地修改其中任何一个都会改变签名，
+    缓存的 hash 不会被继续复用。info.dat 与 parse_song_folder 一样不区分大小写（区分大小写的文件系统上
+    常见 Info.dat）。DirEntry.stat() 在 Windows 上直接使用目录项中的信息，不需要再访问文件。
+    """
+    dat_files = []
+    names = []
+    with os.scandir(entry.path) as items:
+        for item in items:
+            if not item.is_file():
+                continue
+            names.append(item.name)
+            if item.name.lower().endswith('.dat'):
+                item_stat = item.stat()
+                dat_files.append([item.name, item_stat.st_mtime_ns, item_stat.st_size])
+    if not any(name.lower() == 'info.dat' for name, _, _ in dat_files):
+        raise FileNotFoundError(os.path.join(entry.path, 'info.dat'))
+    dat_files.sort()
+    return [entry.stat().st_mtime_ns, dat_files], names
+
+
+def default_scan_workers():
+    """默认并行解析数，与 ThreadPoolExecutor 的默认值一致"""
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def folder_key(folder_name):
+    """从 BeatSaver 下载的文件夹名（如 "1a2b (歌名 - 谱师)"）中取出歌曲 key，无法识别时返回空字符串"""
+    key = folder_name.split(' ', 1)[0].lower()
+    if key and all(c in '0123456789abcdef' for c in key):
+        return key
+    return ''
+
+
+class SongMatcher:
+    """歌单条目与本地歌曲文件夹的匹配器。
+
+    预先建立 歌名->条目列表、小写hash->条目 索引，并使用 SongLibrary 中的 本地谱面hash->文件夹、
+    文件夹名key->文件夹、歌名->文件夹列表 索引，一次匹配只需 O(歌单条目数 + 文件夹数)。
+    优先按计算出的谱面 hash 精确匹配；hash 对不上时依次回退到 key（歌单条目的 key 或
+    LocalCache.saver 中的 id）和歌名匹配；同名的多个条目会依次分配不同的同名文件夹，而不是合并成一个。
+    """
+
+    def __init__(self, songs, library, cache_info):
+        self.songs = songs
+        self.library = library
+        self.cache_info = cache_info
+        self.entries_by_name = {}   # 歌名 -> [歌单条目序号, ...]
+        self.entry_by_hash = {}     # 小写hash -> 第一个使用该hash的歌单条目序号
+        for i, song in enumerate(songs):
+            self.entries_by_name.setdefault(song.get('songName', ''), []).append(i)
+            song_hash = song.get('hash', '').lower()
+            if song_hash:
+                self.entry_by_hash.setdefault(song_hash, i)
+
+    def match(self):
+        """返回与歌单条目一一对应的本地歌曲信息列表，未匹配的位置为 None"""
+        matches = [None] * len(self.songs)
+        claimed = set()  # 已按 hash/key 匹配的文件夹，不再参与歌名匹配
+        primary = []     # 每个 hash 的第一个条目；同 hash 的重复条目最后直接共享结果
+        for i, song in enumerate(self.songs):
+            song_hash = song.get('hash', '').lower()
+            if song_hash and self.entry_by_hash[song_hash] != i:
+                continue
+            primary.append(i)
+            local = self.library.folder_by_hash.get(song_hash) if song_hash else None
+            if local is None:
+                key = (song.get('key') or self.cache_info.get(song_hash, {}).get('id', '')).lower()
+                local = self.library.folder_by_key.get(key) if key else None
+            if local is not None:
+                matches[i] = local
+                claimed.add(local['folder'])
+
+        # 按歌名回退匹配：同名条目依次分配尚未被占用的同名文件夹
+        primary_set = set(primary)
+        for name, entry_ids in self.entries_by_name.items():
+            candidates = [local for local in self.library.folders_by_name.get(name, ()) if local['folder'] not in claimed]
+            if not candidates:
+                continue
+            unmatched = [i for i in entry_ids if i in primary_set and matches[i] is None]
+            for n, i in enumerate(unmatched):
+                matches[i] = candidates[min(n, len(candidates) - 1)]
+
+        for i, song in enumerate(self.songs):
+            song_hash = song.get('hash', '').lower()
+            if song_hash and self.entry_by_hash[song_hash] != i:
+                matches[i] = matches[self.entry_by_hash[song_hash]]
+        return matches
+
+
+DIFFICULTY_BITS = {'Easy': 1, 'Normal': 2, 'Hard': 4, 'Expert': 8, 'ExpertPlus': 16}
+# 难度位掩码 -> 难度名元组，所有歌曲共用这 32 个元组
+DIFFICULTY_NAMES = tuple(tuple(name for name, bit in DIFFICULTY_BITS.items() if mask & bit)
+                         for mask in range(1 << len(DIFFICULTY_BITS)))
+
+
+def difficulty_mask(difficulties):
+    """难度名列表 -> 位掩码（不认识的难度名忽略）"""
+    mask = 0
+    for name in difficulties:
+        mask |= DIFFICULTY_BITS.get(name, 0)
+    return mask
+
+
+class SongRecord:
+    """歌单中一首歌的匹配结果（歌单顺序的列表中每首歌一个）
+
+    使用 __slots__ 而不是字典，5 万首歌、多个歌单时可明显减少内存；难度保存为位掩码，
+    作者、描述、缺失文件列表直接引用歌曲库和 LocalCache.saver 中的同一个对象，不再为每首歌复制。
+    """
+    __slots__ = ('name', 'hash', 'exists', 'path', 'author', 'diff_mask', 'missing_files', 'cache_id', 'cache_desc')
+
+    def __init__(self, name, song_hash, exists=False, path='', author='', diff_mask=0, missing_files=(),
+                 cache_id='', cache_desc=''):
+        self.name = name                    # 歌名
+        self.hash = song_hash               # 歌曲hash（小写）
+        self.exists = exists                # 是否存在本地
+        self.path = path                    # 歌曲文件夹路径
+        self.author = author                # 歌手名
+        self.diff_mask = diff_mask          # 实际存在的难度（DIFFICULTY_BITS 位掩码）
+        self.missing_files = missing_files  # info.dat 中引用但文件夹中不存在的文件
+        self.cache_id = cache_id            # LocalCache.saver中的id
+        self.cache_desc = cache_desc        # LocalCache.saver中的描述
+
+    @classmethod
+    def from_local(cls, local):
+        """由本地歌曲信息（SongLibrary.local_folders 的元素）生成，用于删除孤立/重复的文件夹"""
+        return cls(local['name'], local['hash'], True, local['folder'], local['author'], local['diff_mask'],
+                   local.get('missing_files', ()))
+
+    @property
+    def difficulties(self):
+        """实际存在的难度名（按 Easy 到 ExpertPlus 排列）"""
+        return DIFFICULTY_NAMES[self.diff_mask]
+
+    def __eq__(self, other):
+        if not isinstance(other, SongRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return f"SongRecord({self.name!r}, {self.hash!r}, exists={self.exists})"
+
+    def to_dict(self):
+        """转换为字典（JSON/CSV 报告用），难度展开为名称列表"""
+        data = {field: getattr(self, field) for field in self.__slots__ if field != 'diff_mask'}
+        data.update(difficulties=list(self.difficulties), missing_files=list(self.missing_files))
+        return data
+
+
+def match_playlist_songs(songs, library, cache_info, progress=None):
+    """将歌单条目与本地歌曲、LocalCache.saver 信息合并，生成歌单顺序的 SongRecord 列表
+
+    progress 为可选回调，每处理一个条目调用一次，参数为已处理的条目数。
+    """
+    matches = SongMatcher(songs, library, cache_info).match()
+    song_info_list = []
+    for i, (song, local_info) in enumerate(zip(songs, matches)):
+        if progress:
+            progress(i + 1)
+        record = SongRecord(song.get('songName', ''), song.get('hash', '').lower())
+        if local_info and local_info['egg_ok']:
+            record.exists = True
+            record.path = local_info['folder']
+            record.author = local_info['author']
+            record.diff_mask = local_info['diff_mask']
+            record.missing_files = local_info.get('missing_files', ())
+
+        # LocalCache.saver 信息
+        cache = cache_info.get(record.hash)
+        if cache:
+            record.cache_id = cache.get('id', '')
+            record.cache_desc = cache.get('description', '')
+        song_info_list.append(record)
+    return song_info_list
+
+
+def parse_folders(paths, executor_kind='thread', max_workers=None, counted=False, names=None):
+    """使用线程池或进程池并行解析歌曲文件夹，按输入顺序逐个返回解析结果
+
+    counted 为 True 时逐个返回 (解析结果, 读取的字节数)。names 为与 paths 对应的文件名列表时不再读取目录。
+    """
+    max_workers = max_workers or default_scan_workers()
+    parse = parse_song_folder_counted if counted else parse_song_folder_safe
+    if names is None:
+        names = [None] * len(paths)
+    if max_workers <= 1 or len(paths) <= 1:
+        for path, folder_names in zip(paths, names):
+            yield parse(path, folder_names)
+        return
+    if executor_kind == 'process':
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    with executor:
+        # map 按提交顺序返回结果，保证合并顺序与单线程一致
+        chunksize = max(1, len(paths) // (max_workers * 4)) if executor_kind == 'process' else 1
+        yield from executor.map(parse, paths, names, chunksize=chunksize)
+
+
+class SongLibrary:
+    """本地歌曲库：扫描一次歌曲文件夹并建立 hash/key/歌名 索引，可供多个歌单共享匹配"""
+
+    def __init__(self, songs_folder, local_folders=None):
+        self.songs_folder = songs_folder
+        self.local_folders = []     # 按文件夹名排序的本地歌曲信息（含 folder 路径）
+        self.folder_by_hash = {}    # 本地谱面 hash -> 本地歌曲信息
+        self.folder_by_key = {}     # 文件夹名 key -> 本地歌曲信息
+        self.folders_by_name = {}   # _songName -> [本地歌曲信息, ...]
+        self.folder_sigs = {}       # 文件夹名 -> 上次解析时的签名（含解析失败的文件夹），供增量刷新比较
+        self.incomplete_folders = set()  # 暂时无法解析（没有 info.dat，可能仍在下载中）的文件夹名
+        self.index_hits = 0         # 本次扫描命中扫描索引的文件夹数
+        self.index_misses = 0       # 本次扫描重新解析的文件夹数
+        if local_folders is not None:
+            self.set_folders(local_folders)
+
+    def set_folders(self, local_folders):
+        """设置本地歌曲信息并重建索引"""
+        self.local_folders = local_folders
+        self.folder_by_hash = {}
+        self.folder_by_key = {}
+        self.folders_by_name = {}
+        for local in local_folders:
+            # 难度预先转成位掩码；作者名在大量文件夹间重复，驻留后共用一个字符串
+            local['diff_mask'] = difficulty_mask(local['difficulties'])
+            local['author'] = sys.intern(local['author'])
+            if local.get('hash'):
+                self.folder_by_hash.setdefault(local['hash'], local)
+            key = folder_key(os.path.basename(local['folder']))
+            if key:
+                self.folder_by_key.setdefault(key, local)
+            self.folders_by_name.setdefault(local['name'], []).append(local)
+
+    def scan(self, index_path=None, force_rescan=False, executor_kind='thread', max_workers=None,
+             progress=None, status=None, timings=None):
+        """扫描歌曲文件夹，提取 info.dat 和难度信息（签名未变的文件夹直接使用扫描索引）
+
+        progress(已处理文件夹数, 文件夹总数) 和 status(提示文本) 为可选回调；
+        传入 StageTimings 时记录读取索引、遍历文件夹、解析和保存索引各阶段的耗时。
+        """
+        timings = timings if timings is not None else StageTimings()
+        scan_index = ScanIndex(index_path) if index_path else None
+        index_root = ScanIndex.root_key(self.songs_folder)
+        # 强制重新扫描时也要读取索引：保存时只替换本歌曲文件夹的条目，其它歌曲文件夹的条目保持不变
+        if scan_index:
+            with timings.stage('index_load') as record:
+                scan_index.load()
+                record['count'] = len(scan_index.roots.get(index_root, {}))
+                if os.path.exists(index_path):
+                    record['bytes'] = os.path.getsize(index_path)
+        index_entries = {}
+        pending = []  # 需要重新解析的 (文件夹名, 签名)
+        pending_names = []  # 与 pending 对应的文件名列表，解析时不再读取目录
+        incomplete = set()
+        with timings.stage('walk') as record:
+            dir_entries = list_song_dirs(self.songs_folder)
+            folders = sorted(dir_entries)  # 排序保证结果顺序确定
+            total = record['count'] = len(folders)
+            for i, folder in enumerate(folders):
+                # 待解析的文件夹在解析完成后才计入进度
+                if progress:
+                    progress(i - len(pending), total)
+                try:
+                    sig, names = song_folder_sig(dir_entries[folder])
+                except OSError:
+                    incomplete.add(folder)
+                    continue
+                entry = scan_index.lookup(index_root, folder, sig) if scan_index and not force_rescan else None
+                if entry is None:
+                    pending.append((folder, sig))
+                    pending_names.append(names)
+                else:
+                    index_entries[folder] = entry
+
+        # 并行解析新增或变化的文件夹（读取字节数包括 info.dat 和计算 hash 时读取的难度文件）
+        done = total - len(pending)
+        if pending and status:
+            status(f"正在解析 {len(pending)} 个歌曲文件夹...")
+        paths = [os.path.join(self.songs_folder, folder) for folder, _ in pending]
+        with timings.stage('parse') as record:
+            record['count'] = len(pending)
+            parsed = parse_folders(paths, executor_kind, max_workers, counted=True, names=pending_names)
+            for (folder, sig), (local_info, bytes_read) in zip(pending, parsed):
+                done += 1
+                record['bytes'] += bytes_read
+                index_entries[folder] = {'sig': sig, 'info': local_info}
+                if progress:
+                    progress(done, total)
+
+        # 没写全的文件夹不记录签名，增量刷新时每次都会重新检查
+        incomplete.update(folder for folder, entry in index_entries.items()
+                          if song_folder_incomplete(entry['info']))
+        self.folder_sigs = {folder: entry['sig'] for folder, entry in index_entries.items()
+                            if folder not in incomplete}
+        self.incomplete_folders = incomplete
+
+        # 按文件夹名顺序整理本地歌曲信息
+        local_folders = []
+        for folder in folders:
+            entry = index_entries.get(folder)
+            if entry is None or entry['info'] is None:
+                continue
+            local_folders.append(dict(entry['info'], folder=os.path.join(self.songs_folder, folder)))
+        self.set_folders(local_folders)
+
+        if scan_index:
+            if force_rescan:
+                self.index_hits, self.index_misses = 0, len(pending)
+            else:
+                self.index_hits, self.index_misses = scan_index.hits, scan_index.misses
+            scan_index.replace_root(index_root, index_entries)
+            try:
+                with timings.stage('index_save') as record:
+                    record['count'] = len(index_entries)
+                    scan_index.save()
+            except OSError as e:
+                if status:
+                    status(f"扫描索引保存失败: {e}")
+        else:
+            self.index_hits, self.index_misses = 0, len(pending)
+        return self
+
+    def copy(self):
+        """复制歌曲库（共享各条本地歌曲信息），可在后台线程中刷新副本而不影响正在使用的歌曲库"""
+        library = SongLibrary(self.songs_folder, list(self.local_folders))
+        library.folder_sigs = dict(self.folder_sigs)
+        library.incomplete_folders = set(self.incomplete_folders)
+        return library
+
+    def refresh(self, folders=(), index_path=None):
+        """增量刷新：只重新解析新增的文件夹和 folders 中指定的文件夹，并移除已不存在的文件夹
+
+        与上次扫描相比只需列一次目录，未变化的文件夹不会被读取。返回 (有变化的文件夹名列表,
+        暂时无法解析的文件夹名列表)，后者通常是仍在下载或解压中的文件夹，内容变化后可再次传入 folders。
+        没有写全的文件夹（见 song_folder_incomplete）不记录签名，每次都会重新检查，
+        因此后者即当前全部暂时无法解析的文件夹，同时记入 incomplete_folders。
+        """
+        dir_entries = list_song_dirs(self.songs_folder)
+        current = set(dir_entries)
+        by_folder = {os.path.basename(local['folder']): local for local in self.local_folders}
+        affected = ((current - set(self.folder_sigs)) | (set(self.folder_sigs) - current)
+                    | (set(by_folder) - current) | set(folders))
+        changed = []
+        incomplete = []
+        pending = []  # 需要重新解析的 (文件夹名, 签名)
+        pending_names = []
+        for folder in sorted(affected):
+            if folder not in dir_entries:
+                if self.folder_sigs.pop(folder, None) is not None or folder in by_folder:
+                    by_folder.pop(folder, None)
+                    changed.append(folder)
+                continue
+            try:
+                sig, names = song_folder_sig(dir_entries[folder])
+            except OSError:
+                incomplete.append(folder)
+                continue
+            if self.folder_sigs.get(folder) != sig:
+                pending.append((folder, sig))
+                pending_names.append(names)
+
+        index_updates = {}
+        paths = [os.path.join(self.songs_folder, folder) for folder, _ in pending]
+        for (folder, sig), local_info in zip(pending, parse_folders(paths, names=pending_names)):
+            if local_info is None:
+                # info.dat 可能还没写完，暂不记录签名，下次变化时再解析
+                changed.append(folder)
+                incomplete.append(folder)
+                self.folder_sigs.pop(folder, None)
+                by_folder.pop(folder, None)
+                continue
+            if song_folder_incomplete(local_info):
+                # 其它文件还没写全（如只解压出了 info.dat），同样不记录签名，继续监视直到完整
+                incomplete.append(folder)
+                self.folder_sigs.pop(folder, None)
+                old = by_folder.get(folder)
+                if old is not None and all(old.get(key) == value for key, value in local_info.items()):
+                    continue  # 与上次解析结果相同，不算变化
+            else:
+                self.folder_sigs[folder] = sig
+            changed.append(folder)
+            by_folder[folder] = dict(local_info, folder=os.path.join(self.songs_folder, folder))
+            index_updates[folder] = {'sig': sig, 'info': local_info}
+
+        if changed:
+            self.set_folders([by_folder[folder] for folder in sorted(by_folder)])
+            if index_path:
+                scan_index = ScanIndex(index_path).load()
+                entries = scan_index.roots.setdefault(ScanIndex.root_key(self.songs_folder), {})
+                for folder in changed:
+                    entries.pop(folder, None)
+                entries.update(index_updates)
+                try:
+                    scan_index.save()
+                except OSError:
+                    pass  # 索引只是加速手段，下次完整扫描时会重新写入
+        self.incomplete_folders = set(incomplete)
+        return changed, incomplete
+
+    def match(self, songs, cache_info, progress=None):
+        """将歌单条目与本库匹配，返回歌单顺序的歌曲信息列表"""
+        return match_playlist_songs(songs, self, cache_info, progress=progress)
+
+
+class ScanIndex:
+    """歌曲文件夹扫描索引，持久化为程序同级的 ScanIndex.json。
+
+    按歌曲根目录和文件夹名记录解析结果（含计算出的谱面 hash），签名为文件夹 mtime 加上 info.dat 和各难度文件
+    （文件夹中全部 .dat 文件）的 mtime、大小。重新扫描时签名未变的文件夹直接复用结果，只解析新增或变化的文件夹，
+    已删除的文件夹会被清理，因此每个文件夹只需计算一次 hash。文件夹 mtime 在增删文件（如 .egg）时会变化，
+    难度文件原地修改时只有它自己的 mtime/大小变化，因此都纳入签名。
+    """
+    VERSION = 4
+
+    def __init__(self, path):
+        self.path = path
+        self.roots = {}     # 歌曲根目录 -> {文件夹名: {'sig': [...], 'info': {...} 或 None}}
+        self.hits = 0       # 命中索引的文件夹数
+        self.misses = 0     # 需要重新解析的文件夹数
+
+    def load(self):
+        """读取索引文件，文件不存在、损坏或版本不符时视为空索引"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.roots = data.get('roots', {})
+        except (OSError, ValueError):
+            self.roots = {}
+        return self
+
+    def lookup(self, root, folder, sig):
+        """签名一致时返回缓存的条目，否则返回 None，并统计命中/未命中"""
+        entry = self.roots.get(root, {}).get(folder)
+        if entry is not None and entry.get('sig') == sig:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def root_key(songs_folder):
+        """歌曲根目录在索引中的键"""
+        return os.path.normcase(os.path.abspath(songs_folder))
+
+    def remove_folders(self, root, folders):
+        """从索引中移除指定文件夹（删除歌曲后就地更新，无需重新扫描）"""
+        entries = self.roots.get(root, {})
+        for folder in folders:
+            entries.pop(folder, None)
+
+    def replace_root(self, root, entries):
+        """用本次扫描结果替换某个歌曲根目录下的全部条目（顺带丢弃已删除的文件夹）"""
+        self.roots[root] = entries
+
+    def save(self):
+        """写入临时文件后替换，避免写入中途崩溃导致索引损坏"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'roots': self.roots}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+class ScanSnapshot:
+    """歌曲列表快照，持久化为程序同级的 ScanSnapshot.json，启动时不扫描直接显示上次的结果
+
+    每首歌保存为一行（SongRecord.__slots__ 顺序的列表），同时记录生成快照时的歌单和歌曲文件夹；
+    与当前会话的路径不一致、文件损坏或版本不符时视为没有快照。显示后仍需后台扫描校验。
+    """
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.songs = []     # SongRecord 列表（歌单顺序）
+        self.saved_at = 0   # 快照生成时间（time.time()）
+
+    @staticmethod
+    def key(playlist_path, songs_folder):
+        return [os.path.normcase(os.path.abspath(playlist_path)), ScanIndex.root_key(songs_folder)]
+
+    def load(self, playlist_path, songs_folder):
+        """读取与 playlist_path、songs_folder 对应的快照，返回是否读取成功"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != self.VERSION or data.get('key') != self.key(playlist_path, songs_folder):
+                return False
+            authors = {}  # 同一作者的歌曲共用一个字符串
+            self.songs = [SongRecord(row[0], row[1], row[2], row[3], authors.setdefault(row[4], row[4]), row[5],
+                                     tuple(row[6]), row[7], row[8]) for row in data['songs']]
+            self.saved_at = data.get('time', 0)
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            self.songs = []
+            return False
+        return True
+
+    def save(self, playlist_path, songs_folder, songs):
+        """写入临时文件后替换"""
+        row = operator.attrgetter(*SongRecord.__slots__)
+        data = {'version': self.VERSION, 'key': self.key(playlist_path, songs_folder), 'time': time.time(),
+                'songs': [row(song) for song in songs]}
+        os.replace(write_json_temp(self.path, data, compact=True), self.path)
+
+
+def load_session(path):
+    """读取上次的界面状态（歌单、歌曲文件夹、筛选/排序等），文件不存在或损坏时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_session(path, session):
+    os.replace(write_json_temp(path, session), path)
+
+
+_JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_cache_docs(cache_path):
+    """流式逐个读取 LocalCache.saver 中 docs 数组的元素，内存中只保留当前读取块
+
+    返回 (doc, 起始字节偏移, 字节长度) 的迭代器，偏移量可直接用于 seek 定位该 doc。
+    """
+    decoder = json.JSONDecoder()
+    # newline='' 关闭换行符转换，保证字符与字节偏移一一对应
+    with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+        buf = ''
+        eof = False
+        mark = 0        # buf 中已确定字节偏移的位置
+        mark_bytes = 0  # mark 在文件中的字节偏移
+
+        def read_more():
+            nonlocal buf, eof
+            chunk = f.read(CACHE_CHUNK_SIZE)
+            if chunk:
+                buf += chunk
+            else:
+                eof = True
+
+        # 定位 "docs" 数组的起始位置
+        pos = -1
+        while pos < 0 and not eof:
+            read_more()
+            key_pos = buf.find('"docs"')
+            if key_pos >= 0:
+                pos = buf.find('[', key_pos)
+        if pos < 0:
+            return
+        pos += 1
+
+        while True:
+            pos = _JSON_SEPARATORS.match(buf, pos).end()
+            if pos >= len(buf):
+                if eof:
+                    return
+                read_more()
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                doc, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()
+                continue
+            start_bytes = mark_bytes + len(buf[mark:pos].encode('utf-8'))
+            length = len(buf[pos:end].encode('utf-8'))
+            yield doc, start_bytes, length
+            mark, mark_bytes = end, start_bytes + length
+            pos = end
+            # 已处理的内容超过一个读取块时再整体丢弃，避免逐条复制缓冲区
+            if mark > CACHE_CHUNK_SIZE:
+                buf = buf[mark:]
+                pos -= mark
+                mark = 0
+
+
+def cache_entry(doc):
+    """从 LocalCache.saver 的 doc 中取出界面需要的 id/名称/描述"""
+    return {
+        'id': doc.get('id', ''),
+        'name': doc.get('name', ''),
+        'description': doc.get('description', ''),
+    }
+
+
+def load_cache_info(cache_path, wanted_hashes, use_index=True, timings=None):
+    """读取 LocalCache.saver，返回 wanted_hashes 中各小写 hash 对应的 id/名称/描述
+
+    只保留歌单中出现的 hash，不会为整个缓存文件建立字典。use_index 为 True 时使用旁路索引
+    （LocalCache.saver.idx，记录 hash -> doc 字节偏移），索引随 LocalCache.saver 的 mtime/大小
+    自动重建；索引有效时只需按偏移读取所需的 doc。传入 StageTimings 时记录各阶段耗时和读取量。
+    """
+    timings = timings if timings is not None else StageTimings()
+    index_path = cache_path + CACHE_INDEX_SUFFIX
+    cache_stat = os.stat(cache_path)
+    sig = [cache_stat.st_mtime_ns, cache_stat.st_size]
+    offsets = None
+    if use_index:
+        with timings.stage('cache_index_load') as record:
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    index_data = json.load(f)
+                record['bytes'] = f.tell()
+                if index_data.get('sig') == sig:
+                    offsets = index_data.get('offsets', {})
+                    record['count'] = len(offsets)
+            except (OSError, ValueError):
+                offsets = None
+
+    cache_info = {}
+    if offsets is not None:
+        # 索引有效：按偏移读取所需的 doc，同一 doc 只解析一次
+        with timings.stage('cache_seek') as record:
+            wanted_offsets = {}
+            for song_hash in wanted_hashes:
+                if song_hash in offsets:
+                    wanted_offsets.setdefault(tuple(offsets[song_hash]), []).append(song_hash)
+            with open(cache_path, 'rb') as f:
+                for (start, length), hashes in sorted(wanted_offsets.items()):
+                    f.seek(start)
+                    entry = cache_entry(json.loads(f.read(length)))
+                    record['count'] += 1
+                    record['bytes'] += length
+                    for song_hash in hashes:
+                        cache_info[song_hash] = entry
+        return cache_info
+
+    # 流式读取整个文件，顺便重建索引
+    new_offsets = {} if use_index else None
+    with timings.stage('cache_stream') as record:
+        record['bytes'] = cache_stat.st_size
+        for doc, start, length in iter_cache_docs(cache_path):
+            record['count'] += 1
+            entry = None
+            for version in doc.get('versions', []):
+                song_hash = version.get('hash', '').lower()
+                if new_offsets is not None:
+                    new_offsets[song_hash] = [start, length]
+                if song_hash in wanted_hashes:
+                    entry = entry or cache_entry(doc)
+                    cache_info[song_hash] = entry
+    if new_offsets is not None:
+        try:
+            with timings.stage('cache_index_save') as record:
+                record['count'] = len(new_offsets)
+                tmp_path = index_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'sig': sig, 'offsets': new_offsets}, f, separators=(',', ':'))
+                os.replace(tmp_path, index_path)
+        except OSError:
+            pass  # 索引只是加速手段，写入失败不影响本次结果
+    return cache_info
+
+
+class MetadataCache:
+    """联网查询到的歌曲信息缓存（BeatSaverCache.json），按 hash 保存与 cache_entry 相同格式的 id/名称/描述
+
+    BeatSaver 上不存在的 hash 也会记录（entry 为 None），有效期较短；过期的条目在读取时丢弃，
+    条目数超过上限时保存前丢弃最早查询的条目。
+    """
+    VERSION = 1
+
+    def __init__(self, path, ttl=METADATA_TTL, miss_ttl=METADATA_MISS_TTL, max_entries=METADATA_CACHE_MAX):
+        self.path = path
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        self.entries = {}   # 小写 hash -> {'entry': {...} 或 None, 'time': 查询时间}
+
+    def load(self):
+        """读取缓存文件并丢弃过期条目，文件不存在、损坏或版本不符时视为空缓存
+
+        格式不符的条目（如手工改坏的文件）逐条丢弃，不会让扫描中断。
+        """
+        entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get('version') == self.VERSION \
+                    and isinstance(data.get('entries'), dict):
+                entries = data['entries']
+        except (OSError, ValueError):
+            pass
+        now = time.time()
+        self.entries = {}
+        for song_hash, item in entries.items():
+            if not isinstance(item, dict):
+                continue
+            entry, queried = item.get('entry'), item.get('time')
+            if not isinstance(queried, (int, float)) or not (entry is None or isinstance(entry, dict)):
+                continue
+            if now - queried < (self.ttl if entry else self.miss_ttl):
+                self.entries[song_hash] = {'entry': cache_entry(entry) if entry else None, 'time': queried}
+        return self
+
+    def fill(self, cache_info, hashes):
+        """把缓存中查询到的信息补充到 cache_info（LocalCache.saver 中已有的 hash 不覆盖）"""
+        for song_hash in hashes:
+            item = self.entries.get(song_hash)
+            if item and item['entry'] and song_hash not in cache_info:
+                cache_info[song_hash] = item['entry']
+        return cache_info
+
+    def unknown(self, hashes):
+        """返回缓存中没有记录（从未查询或已过期）的 hash 列表，保持输入顺序并去重"""
+        return [song_hash for song_hash in dict.fromkeys(hashes) if song_hash and song_hash not in self.entries]
+
+    def update(self, results):
+        """记录一批查询结果 {hash: 条目或 None}"""
+        now = time.time()
+        for song_hash, entry in results.items():
+            self.entries[song_hash] = {'entry': entry, 'time': now}
+
+    def save(self):
+        """丢弃超出上限的最早条目后写入临时文件再替换"""
+        if len(self.entries) > self.max_entries:
+            newest = sorted(self.entries.items(), key=lambda item: item[1]['time'])[-self.max_entries:]
+            self.entries = dict(newest)
+        tmp_path = write_json_temp(self.path, {'version': self.VERSION, 'entries': self.entries}, compact=True)
+        os.replace(tmp_path, self.path)
+
+
+class MetadataResolver:
+    """按 hash 向 BeatSaver 批量查询歌曲信息
+
+    resolve() 是协程：hash 按 batch_size 分批，由 asyncio 调度，最多 concurrency 个请求同时进行。
+    每个请求占用连接池中的一个 HTTP keep-alive 连接（阻塞的 http.client 请求放到线程中执行），
+    请求结束后连接放回池中供下一批复用。base_url 可指向本地的测试服务器。
+    """
+
+    def __init__(self, base_url=BEATSAVER_API, concurrency=METADATA_CONCURRENCY, batch_size=METADATA_BATCH_SIZE,
+                 timeout=15):
+        import http.client
+        import urllib.parse
+        parts = urllib.parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.base_path = parts.path.rstrip('/')
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+
+    def fetch_batch(self, conn, hashes):
+        """用 conn 查询一批 hash，返回 {hash: cache_entry 或 None（BeatSaver 上不存在）}"""
+        conn.request('GET', f"{self.base_path}/maps/hash/{','.join(hashes)}",
+                     headers={'Accept': 'application/json', 'User-Agent': 'Beat-Saber-Playlist-File-Sync'})
+        response = conn.getresponse()
+        body = response.read()  # 读完响应体，连接才能复用
+        if response.status == 404:
+            return dict.fromkeys(hashes)
+        if response.status != 200:
+            raise OSError(f"HTTP {response.status} {response.reason}")
+        data = json.loads(body)
+        if 'id' in data:
+            maps = dict.fromkeys(hashes, data)  # 只查询一个 hash 时返回的是谱面本身
+        else:
+            maps = {song_hash.lower(): doc for song_hash, doc in data.items()}
+        return {song_hash: cache_entry(maps[song_hash]) if maps.get(song_hash) else None for song_hash in hashes}
+
+    async def resolve(self, hashes, on_batch=None, errors=None, results=None):
+        """查询 hashes，返回 {hash: cache_entry 或 None}；失败的批次不出现在结果中
+
+        on_batch(本批结果) 在每批完成时调用（在事件循环所在线程中）；传入 errors 列表时记录失败原因。
+        每个批次单独捕获异常（包括响应格式不符导致的 KeyError/TypeError），一个批次失败不影响其它批次；
+        传入 results 字典时结果逐批写入其中，即使整个查询意外中断，调用方也能保留并缓存已完成的批次。
+        """
+        import asyncio
+        batches = [hashes[i:i + self.batch_size] for i in range(0, len(hashes), self.batch_size)]
+        pool = asyncio.Queue()
+        for _ in range(min(self.concurrency, len(batches))):
+            pool.put_nowait(None)  # 连接在第一次使用时建立
+        results = {} if results is None else results
+
+        async def run(batch):
+            conn = await pool.get()
+            try:
+                if conn is None:
+                    conn = self.connection_class(self.netloc, timeout=self.timeout)
+                found = await asyncio.to_thread(self.fetch_batch, conn, batch)
+            except Exception as e:
+                if conn is not None:
+                    conn.close()
+                conn = None  # 出错的连接丢弃，下一批重新建立
+                if errors is not None:
+                    errors.append(f"{len(batch)} 个 hash 查询失败: {e}")
+                return
+            finally:
+                pool.put_nowait(conn)
+            results.update(found)
+            if on_batch:
+                on_batch(found)
+
+        try:
+            await asyncio.gather(*(run(batch) for batch in batches))
+        finally:
+            while not pool.empty():
+                conn = pool.get_nowait()
+                if conn is not None:
+                    conn.close()
+        return results
+
+
+def apply_metadata(songs, entries):
+    """把查询到的 {hash: 条目} 填入缺少 id 的 SongRecord，返回被更新的行号列表"""
+    rows = []
+    for row, song in enumerate(songs):
+        entry = entries.get(song.hash)
+        if entry and not song.cache_id:
+            song.cache_id = entry.get('id', '')
+            song.cache_desc = entry.get('description', '')
+            rows.append(row)
+    return rows
+
+
+def read_playlist(playlist_path):
+    """读取歌单文件，返回 JSON 数据"""
+    with open(playlist_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_playlists(playlists_dir, errors=None):
+    """递归列出 Playlists 目录及其子文件夹中的所有歌单文件（同一目录内按文件名排序）
+
+    传入 errors 列表时，无法读取的子文件夹以 (路径, 错误) 记入其中，否则直接抛出异常。
+    """
+    def on_error(e):
+        if errors is None:
+            raise e
+        errors.append((e.filename, str(e)))
+
+    paths = []
+    for root, dirs, files in os.walk(playlists_dir, onerror=on_error):
+        dirs.sort()
+        paths += [os.path.join(root, name) for name in sorted(files) if name.lower().endswith(PLAYLIST_EXTENSIONS)]
+    return paths
+
+
+def evaluate_playlists(playlist_paths, library, cache_path=None, use_cache_index=True, errors=None,
+                       timings=None, metadata=None):
+    """用同一个歌曲库评估多个歌单，返回 [{'path', 'title', 'songs': 歌曲信息列表}, ...]
+
+    LocalCache.saver 只读取一次，保留所有歌单中出现的 hash；传入 MetadataCache 时，
+    LocalCache.saver 中没有的 hash 再从联网查询的缓存中补充。
+    传入 errors 列表时，读取失败的歌单以 (路径, 错误) 记入其中并跳过，否则直接抛出异常。
+    """
+    timings = timings if timings is not None else StageTimings()
+    playlists = []
+    with timings.stage('playlist') as record:
+        for path in playlist_paths:
+            try:
+                record['bytes'] += os.path.getsize(path)
+                data = read_playlist(path)
+            except (OSError, ValueError) as e:
+                if errors is None:
+                    raise
+                errors.append((path, str(e)))
+                continue
+            playlists.append((path, data.get('playlistTitle', '未知歌单'), data.get('songs', [])))
+            record['count'] += len(playlists[-1][2])
+    cache_info = {}
+    wanted_hashes = set(song.get('hash', '').lower() for _, _, songs in playlists for song in songs)
+    if cache_path and os.path.exists(cache_path):
+        cache_info = load_cache_info(cache_path, wanted_hashes, use_index=use_cache_index, timings=timings)
+    if metadata is not None:
+        metadata.fill(cache_info, wanted_hashes)
+    with timings.stage('match') as record:
+        record['count'] = sum(len(songs) for _, _, songs in playlists)
+        return [{'path': path, 'title': title, 'songs': library.match(songs, cache_info)}
+                for path, title, songs in playlists]
+
+
+def write_json_temp(path, data, compact=False):
+    """把 data 写入 path 同目录下的临时文件并 fsync，返回临时文件路径（由调用方 os.replace 到 path）"""
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        if os.path.exists(path):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))  # mkstemp 默认只有属主可读写
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # 先整体编码再一次写入：json.dump 逐块写文件，大文件时慢数倍
+            if compact:
+                f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+            else:
+                f.write(json.dumps(data, indent=2, ensure_ascii=False))
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def fsync_dir(path):
+    """fsync 目录，使 os.replace 的结果落盘（Windows 不支持打开目录，直接跳过）"""
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class PlaylistTransaction:
+    """批量修改多个歌单的事务：按歌单累积要移除的 hash，提交时统一读写
+
+    提交时先把所有歌单写入各自的临时文件（fsync），全部成功后才依次 os.replace；
+    任何一个歌单读取或写入失败都会删除已写的临时文件并抛出异常，所有歌单保持原样。
+    每个歌单的替换是原子的，但多个歌单之间不是：某次 os.replace 失败（如 Windows 上文件被占用）时，
+    之前的歌单已经替换，其余歌单保持原样，剩下的临时文件会被删除，异常照常抛出，
+    已替换的歌单路径记录在 committed 中。写入中途崩溃最多留下临时文件，原歌单不会被截断。
+    compact 为 True 时写成紧凑 JSON，为 'auto' 时只对歌曲数不少于 COMPACT_PLAYLIST_SONGS 的歌单紧凑写入。
+    """
+
+    def __init__(self, compact=False):
+        self.compact = compact
+        self.removals = {}  # 歌单路径 -> 要移除的小写 hash 集合
+        self.committed = []  # 最近一次提交中已替换的歌单路径
+
+    def remove(self, playlist_path, hashes):
+        """登记从歌单中移除指定 hash（不区分大小写）的歌曲"""
+        self.removals.setdefault(playlist_path, set()).update(h.lower() for h in hashes if h)
+        return self
+
+    def commit(self):
+        """执行所有登记的修改，返回 {歌单路径: 移除的条目数}（没有可移除条目的歌单不重写）"""
+        removed = {}
+        pending = []  # (临时文件路径, 歌单路径)
+        try:
+            for path, hashes in self.removals.items():
+                playlist_data = read_playlist(path)
+                original_songs = playlist_data.get('songs', [])
+                updated_songs = [song for song in original_songs
+                                 if (song.get('hash') or '').lower() not in hashes]
+                removed[path] = len(original_songs) - len(updated_songs)
+                if not removed[path]:
+                    continue
+                playlist_data['songs'] = updated_songs
+                compact = self.compact
+                if compact == 'auto':
+                    compact = len(updated_songs) >= COMPACT_PLAYLIST_SONGS
+                pending.append((write_json_temp(path, playlist_data, compact), path))
+        except BaseException:
+            for tmp_path, _ in pending:
+                os.remove(tmp_path)
+            raise
+        self.committed = []
+        try:
+            for tmp_path, path in pending:
+                os.replace(tmp_path, path)
+                self.committed.append(path)
+        finally:
+            for tmp_path, _ in pending[len(self.committed):]:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+        for folder in set(os.path.dirname(os.path.abspath(path)) for _, path in pending):
+            fsync_dir(folder)
+        self.removals = {}
+        return removed
+
+
+def remove_playlist_entries(playlist_path, hashes, compact=False):
+    """从歌单文件中移除指定 hash（不区分大小写）的歌曲（原子替换），返回移除的条目数"""
+    return PlaylistTransaction(compact).remove(playlist_path, hashes).commit()[playlist_path]
+
+
+class PlaylistRefIndex:
+    """歌曲 hash -> 引用它的歌单 的反向索引，覆盖整个 Playlists 目录
+
+    每个歌单（包括子文件夹中的）按（mtime, 大小）缓存其中的 hash、key 和歌名，持久化到 PlaylistRefs.json；
+    update() 只重新读取变化的歌单，已删除的歌单自动移除。查询某首歌被哪些歌单引用为 O(1)，
+    查找没有任何歌单引用的本地文件夹只需遍历一次歌曲库。
+    """
+    VERSION = 2
+
+    def __init__(self, path=None):
+        self.path = path        # 持久化路径，可选
+        self.dirs = {}          # 歌单目录 -> {相对路径: {'sig', 'hashes', 'keys', 'names'}}
+        self.refs = {}          # 小写 hash -> [歌单路径, ...]
+        self.key_refs = {}      # 小写 key -> [歌单路径, ...]
+        self.names = set()      # 所有歌单条目的歌名（按歌名回退匹配时用到）
+        self.errors = []        # 读取失败的 (歌单路径, 错误信息)
+        self.changed = False
+
+    def load(self):
+        """读取持久化的索引，文件不存在、损坏或版本不符时视为空索引"""
+        if not self.path:
+            return self
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.dirs = data.get('dirs', {})
+        except (OSError, ValueError):
+            self.dirs = {}
+        return self
+
+    def save(self):
+        """索引有变化时写入临时文件后替换"""
+        if not self.path or not self.changed:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'dirs': self.dirs}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    @staticmethod
+    def path_key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def update(self, playlists_dirs):
+        """按歌单 mtime/大小增量更新指定目录，并只用这些目录中的歌单重建反向索引"""
+        self.refs = {}
+        self.key_refs = {}
+        self.names = set()
+        self.errors = []
+        for playlists_dir in playlists_dirs:
+            dir_key = self.path_key(playlists_dir)
+            old_entries = self.dirs.get(dir_key, {})
+            entries = {}
+            for playlist_path in find_playlists(playlists_dir, self.errors):
+                name = os.path.relpath(playlist_path, playlists_dir)
+                try:
+                    playlist_stat = os.stat(playlist_path)
+                except OSError as e:
+                    self.errors.append((playlist_path, str(e)))
+                    continue
+                sig = [playlist_stat.st_mtime_ns, playlist_stat.st_size]
+                entry = old_entries.get(name)
+                if entry is None or entry['sig'] != sig:
+                    try:
+                        songs = read_playlist(playlist_path).get('songs', [])
+                    except (OSError, ValueError) as e:
+                        self.errors.append((playlist_path, str(e)))
+                        continue
+                    entry = {
+                        'sig': sig,
+                        'hashes': sorted(set(song.get('hash', '').lower() for song in songs) - {''}),
+                        'keys': sorted(set(str(song.get('key', '')).lower() for song in songs) - {''}),
+                        'names': sorted(set(song.get('songName', '') for song in songs) - {''}),
+                    }
+                    self.changed = True
+                entries[name] = entry
+                for song_hash in entry['hashes']:
+                    self.refs.setdefault(song_hash, []).append(playlist_path)
+                for key in entry['keys']:
+                    self.key_refs.setdefault(key, []).append(playlist_path)
+                self.names.update(entry['names'])
+            if entries.keys() != old_entries.keys():
+                self.changed = True
+            self.dirs[dir_key] = entries
+        return self
+
+    def playlists_for(self, song_hash):
+        """引用该 hash 的所有歌单路径"""
+        return self.refs.get(song_hash.lower(), [])
+
+    def other_playlists(self, song_hash, playlist_path):
+        """除 playlist_path 外还引用该 hash 的歌单路径"""
+        own = self.path_key(playlist_path)
+        return [path for path in self.playlists_for(song_hash) if self.path_key(path) != own]
+
+    def referenced_cache_info(self, cache_path, metadata=None, use_index=True):
+        """被引用的 hash 在 LocalCache.saver（和联网查询缓存）中的信息，匹配时这些 id 也会作为文件夹 key 使用"""
+        cache_info = {}
+        if cache_path and os.path.exists(cache_path):
+            cache_info = load_cache_info(cache_path, set(self.refs), use_index=use_index)
+        if metadata is not None:
+            metadata.fill(cache_info, self.refs)
+        return cache_info
+
+    def find_orphans(self, library, matched_folders=(), cache_info=None):
+        """返回歌曲库中没有被任何歌单引用的本地歌曲信息
+
+        以下文件夹都不视为孤立：已评估的歌单实际匹配到的文件夹（matched_folders，即匹配结果的 path）；
+        hash 被引用；文件夹 key 是歌单条目的 key 或被引用 hash 在 cache_info 中的 id；
+        有歌单条目与它同名（可能按歌名回退匹配）；未能计算 hash。状态不明确的文件夹宁可保留。
+        """
+        matched = set(self.path_key(path) for path in matched_folders if path)
+        keys = set(self.key_refs)
+        keys.update(str(entry.get('id', '')).lower() for entry in (cache_info or {}).values())
+        orphans = []
+        for local in library.local_folders:
+            if not local.get('hash') or local['hash'] in self.refs or local['name'] in self.names:
+                continue
+            if self.path_key(local['folder']) in matched:
+                continue
+            key = folder_key(os.path.basename(local['folder']))
+            if key and key in keys:
+                continue
+            orphans.append(local)
+        return orphans
+
+
+def folder_files(folder_path):
+    """递归列出文件夹中的文件，返回按相对路径排序的 [(相对路径, 字节数), ...]（只读目录项，不读文件内容）"""
+    files = []
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(folder_path, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel_path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((rel_path.replace(os.sep, '/'), entry.stat(follow_symlinks=False).st_size))
+    files.sort()
+    return files
+
+
+def folder_content_digest(folder_path, files):
+    """按 folder_files 的顺序对文件名和内容分块计算 SHA-1，内容完全相同的文件夹结果相同"""
+    sha1 = hashlib.sha1()
+    for rel_path, size in files:
+        sha1.update(f"{rel_path}\0{size}\0".encode('utf-8'))
+        with open(os.path.join(folder_path, rel_path), 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def format_size(size):
+    """字节数转换为便于阅读的文本"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def find_duplicates(library, max_workers=None, progress=None, matched_folders=()):
+    """查找重复的歌曲文件夹，返回按可释放空间从大到小排序的重复组列表
+
+    先按计算出的谱面 hash 分组（无需读盘）；hash 为空的文件夹再按内容分组。只对组内文件夹列目录统计大小，
+    文件列表和大小都相同（可能完全一致）的文件夹才分块计算内容摘要。matched_folders 为歌单实际匹配到的
+    文件夹（匹配结果的 path，可能是按 key 或歌名匹配的）：每组优先保留其中的文件夹，它们也都不会作为重复文件夹；
+    没有时保留按 hash 匹配会使用的文件夹，其余为可删除的重复文件夹。每组为 {'hash', 'name', 'keep', 'duplicates', 'sizes', 'identical', 'reclaimable'}，
+    identical 为内容与保留文件夹完全相同的重复文件夹路径集合。progress(已处理文件夹数, 总数) 为可选回调。
+    """
+    matched = set(matched_folders)
+    by_hash = {}
+    no_hash = []
+    for local in library.local_folders:
+        if local.get('hash'):
+            by_hash.setdefault(local['hash'], []).append(local)
+        else:
+            no_hash.append(local)
+    candidates = [group for group in by_hash.values() if len(group) > 1]
+    if len(no_hash) > 1:
+        candidates.append(no_hash)
+    folders = [local['folder'] for group in candidates for local in group]
+    total = len(folders)
+    if progress:
+        progress(0, total)
+
+    # 第一步：并行列目录，得到文件列表和大小（只读目录项）
+    files_by_folder = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=max_workers or default_scan_workers()) as executor:
+        for folder, files in zip(folders, executor.map(_folder_files_safe, folders)):
+            files_by_folder[folder] = files
+            done += 1
+            if progress:
+                progress(done, total)
+
+        # 第二步：文件列表和大小都相同的文件夹才计算内容摘要
+        to_digest = []
+        for group in candidates:
+            seen = {}
+            for local in group:
+                files = files_by_folder[local['folder']]
+                if files is not None:
+                    seen.setdefault(tuple(files), []).append(local['folder'])
+            to_digest += [folder for same in seen.values() if len(same) > 1 for folder in same]
+        digests = dict(zip(to_digest, executor.map(
+            lambda folder: _folder_digest_safe(folder, files_by_folder[folder]), to_digest)))
+
+    groups = []
+    for group in candidates:
+        group = [local for local in group if files_by_folder[local['folder']] is not None]
+        if group and not group[0].get('hash'):
+            # 没有谱面 hash 的文件夹只有内容完全相同时才算重复
+            by_digest = {}
+            for local in group:
+                if digests.get(local['folder']):
+                    by_digest.setdefault(digests[local['folder']], []).append(local)
+            subgroups = [same for same in by_digest.values() if len(same) > 1]
+        else:
+            subgroups = [group] if len(group) > 1 else []
+        for members in subgroups:
+            in_use = [local for local in members if local['folder'] in matched]
+            keep = library.folder_by_hash.get(members[0].get('hash', ''))
+            if keep not in (in_use or members):
+                keep = (in_use or members)[0]
+            duplicates = [local for local in members if local is not keep and local['folder'] not in matched]
+            if not duplicates:
+                continue
+            sizes = {local['folder']: sum(size for _, size in files_by_folder[local['folder']]) for local in members}
+            keep_digest = digests.get(keep['folder'])
+            groups.append({
+                'hash': keep.get('hash', ''),
+                'name': keep['name'],
+                'keep': keep,
+                'duplicates': duplicates,
+                'sizes': sizes,
+                'identical': set(local['folder'] for local in duplicates
+                                 if keep_digest and digests.get(local['folder']) == keep_digest),
+                'reclaimable': sum(sizes[local['folder']] for local in duplicates),
+            })
+    groups.sort(key=lambda group: (-group['reclaimable'], group['keep']['folder']))
+    return groups
+
+
+def _folder_files_safe(folder_path):
+    try:
+        return folder_files(folder_path)
+    except OSError:
+        return None
+
+
+def _folder_digest_safe(folder_path, files):
+    try:
+        return folder_content_digest(folder_path, files)
+    except OSError:
+        return None
+
+
+def unique_path(path, reserved=(), is_file=False):
+    """path 已存在（或已被占用）时依次尝试 "名称 (2)"、"名称 (3)"……，返回第一个可用的路径
+
+    is_file 为 True 时编号加在扩展名之前；文件夹名中的“.”不视为扩展名。
+    """
+    if not os.path.exists(path) and path not in reserved:
+        return path
+    root, ext = os.path.splitext(path) if is_file else (path, '')
+    n = 2
+    while True:
+        candidate = f"{root} ({n}){ext}"
+        if not os.path.exists(candidate) and candidate not in reserved:
+            return candidate
+        n += 1
+
+
+class BackupSession:
+    """一次删除操作的备份会话，可在多个线程中同时调用
+
+    - 歌曲文件夹与 backup 在同一文件系统时，直接用 os.replace 移入 backup，备份和删除合为一次元数据操作；
+    - 跨文件系统时，默认复制到 backup 后删除；archive 为 'zip' 或 'tar.zst' 时改为流式写入本次会话的归档文件；
+    - 同名备份已存在时自动改名（"名称 (2)"），不会跳过；
+    - 每首歌的 hash、原路径和备份位置记录在 backup/manifest.json 中，便于按原样恢复。
+    """
+    ARCHIVE_FORMATS = ('zip', 'tar.zst')
+
+    def __init__(self, backup_folder, archive=None):
+        self.backup_folder = backup_folder
+        self.archive = archive          # None / 'zip' / 'tar.zst'
+        self.session_name = time.strftime("session-%Y%m%d-%H%M%S")
+        self.entries = []               # 本次会话新增的清单条目
+        self._lock = threading.RLock()  # open_archive 在持锁时调用 reserve_path
+        self._reserved = set()          # 已分配但尚未写入的备份路径
+        self._archive_names = set()     # 归档内已使用的顶层名称
+        self._archive = None            # 打开的归档对象（首次需要时创建）
+        self._archive_path = None
+        self._archive_closers = []
+        self._backup_dev = os.stat(backup_folder).st_dev
+
+    def reserve_path(self, name, is_file=False):
+        """在 backup 文件夹中为 name 分配一个不重名的路径"""
+        with self._lock:
+            path = unique_path(os.path.join(self.backup_folder, name), self._reserved, is_file)
+            self._reserved.add(path)
+            return path
+
+    def record(self, song, method, backup_path, member=None):
+        entry = {
+            'hash': song.hash,
+            'name': song.name,
+            'original_path': os.path.abspath(song.path),
+            'method': method,           # move / copy / archive
+            'backup_path': os.path.relpath(backup_path, self.backup_folder),
+            'member': member,           # 归档内的顶层目录名（仅 archive）
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self._lock:
+            self.entries.append(entry)
+
+    def backup_file(self, path):
+        """备份单个文件（如歌单文件），同名已存在时改名，返回备份路径"""
+        backup_path = self.reserve_path(os.path.basename(path), is_file=True)
+        shutil.copy2(path, backup_path)
+        return backup_path
+
+    def backup_and_delete(self, song):
+        """备份并删除一首歌曲（SongRecord）的文件夹"""
+        song_path = song.path
+        name = os.path.basename(os.path.normpath(song_path))
+        if os.stat(song_path).st_dev == self._backup_dev:
+            # 同一文件系统：移动即备份
+            backup_path = self.reserve_path(name)
+            os.replace(song_path, backup_path)
+            self.record(song, 'move', backup_path)
+        elif self.archive in self.ARCHIVE_FORMATS:
+            member = self.add_to_archive(song_path, name)
+            shutil.rmtree(song_path)
+            self.record(song, 'archive', self._archive_path, member)
+        else:
+            backup_path = self.reserve_path(name)
+            shutil.copytree(song_path, backup_path)
+            shutil.rmtree(song_path)
+            self.record(song, 'copy', backup_path)
+
+    def open_archive(self):
+        """创建本次会话的归档文件（调用方需持有锁）"""
+        import tarfile
+        import zipfile
+        if self.archive == 'zip':
+            self._archive_path = self.reserve_path(self.session_name + '.zip', is_file=True)
+            self._archive = zipfile.ZipFile(self._archive_path, 'w', zipfile.ZIP_DEFLATED)
+            self._archive_closers = [self._archive.close]
+        else:
+            if zstandard is None:
+                raise RuntimeError("未安装 zstandard，无法使用 tar.zst 归档")
+            self._archive_path = self.reserve_path(self.session_name + '.tar.zst', is_file=True)
+            fileobj = open(self._archive_path, 'wb')
+            stream = zstandard.ZstdCompressor().stream_writer(fileobj)
+            self._archive = tarfile.open(fileobj=stream, mode='w|')
+            self._archive_closers = [self._archive.close, stream.close]
+
+    def add_to_archive(self, song_path, name):
+        """把歌曲文件夹流式写入会话归档，返回归档内的顶层目录名"""
+        with self._lock:
+            if self._archive is None:
+                self.open_archive()
+            member = name
+            n = 2
+            while member in self._archive_names:
+                member = f"{name} ({n})"
+                n += 1
+            self._archive_names.add(member)
+            if self.archive == 'zip':
+                for root, _, files in os.walk(song_path):
+                    arc_root = os.path.join(member, os.path.relpath(root, song_path))
+                    self._archive.write(root, os.path.normpath(arc_root))
+                    for filename in files:
+                        self._archive.write(os.path.join(root, filename),
+                                            os.path.normpath(os.path.join(arc_root, filename)))
+            else:
+                self._archive.add(song_path, arcname=member)
+        return member
+
+    def close(self):
+        """关闭归档并把本次会话的条目追加到备份清单"""
+        with self._lock:
+            for closer in self._archive_closers:
+                closer()
+            self._archive = None
+            self._archive_closers = []
+            if self.entries:
+                save_backup_manifest(self.backup_folder,
+                                     load_backup_manifest(self.backup_folder) + self.entries)
+
+
+def load_backup_manifest(backup_folder):
+    """读取备份清单，返回条目列表；清单不存在或损坏时返回空列表"""
+    try:
+        with open(os.path.join(backup_folder, BACKUP_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f).get('entries', [])
+    except (OSError, ValueError):
+        return []
+
+
+def save_backup_manifest(backup_folder, entries):
+    """写入备份清单（先写临时文件再替换）"""
+    manifest_path = os.path.join(backup_folder, BACKUP_MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'entries': entries}, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def index_backup_folders(backup_folder, max_workers=None, progress=None, cancelled=None):
+    """把 backup 中没有清单条目的歌曲文件夹补进备份清单，返回完整的清单条目列表
+
+    旧版本直接复制到 backup 的文件夹没有清单，这里计算谱面 hash 后按 'copy' 方式记录，
+    备份时间取文件夹的修改时间；补入的条目写回清单，之后不必再次计算。
+    无法解析或算不出 hash 的文件夹不记录。
+    progress(已处理文件夹数, 总数) 为可选回调；cancelled() 返回 True 时不再处理剩余的文件夹，
+    已算出的条目照常写回清单。
+    """
+    entries = load_backup_manifest(backup_folder)
+    known = set(os.path.normcase(os.path.normpath(entry['backup_path'])) for entry in entries)
+    folders = []
+    try:
+        with os.scandir(backup_folder) as it:
+            for entry in it:
+                if (entry.is_dir() and not entry.name.startswith('.')
+                        and os.path.normcase(entry.name) not in known):
+                    folders.append(entry)
+    except OSError:
+        return entries
+    if not folders:
+        return entries
+    folders.sort(key=lambda entry: entry.name)
+    parsed = []
+    with ThreadPoolExecutor(max_workers=max_workers or default_scan_workers()) as executor:
+        futures = {executor.submit(parse_song_folder_safe, folder.path): folder for folder in folders}
+        for future in as_completed(futures):
+            parsed.append((futures[future], future.result()))
+            if progress:
+                progress(len(parsed), len(folders))
+            if cancelled and cancelled():
+                for pending in futures:
+                    pending.cancel()
+                break
+    indexed = []
+    for folder, info in parsed:
+        if not info or not info['hash']:
+            continue
+        try:
+            mtime = folder.stat().st_mtime
+        except OSError:
+            continue
+        indexed.append({
+            'hash': info['hash'],
+            'name': info['name'],
+            'original_path': folder.name,   # 原路径未知，恢复时只用到文件夹名
+            'method': 'copy',
+            'backup_path': folder.name,
+            'member': None,
+            'time': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime)),
+        })
+    if not indexed:
+        return entries
+    # 补入的备份早于清单记录的删除，放在前面，按时间排序
+    indexed.sort(key=lambda entry: (entry['time'], entry['backup_path']))
+    entries = indexed + entries
+    try:
+        save_backup_manifest(backup_folder, entries)
+    except OSError:
+        pass  # 清单写不进去时本次仍可使用，下次再补
+    return entries
+
+
+def find_restorable(backup_folder, hashes, progress=None, cancelled=None):
+    """在备份清单中查找 hashes 的备份，返回 {小写 hash: 清单条目}
+
+    查找前先用 index_backup_folders 把没有清单条目的旧备份文件夹补进清单（progress、cancelled 传给它）。
+    同一 hash 有多份备份时取最新的一份；备份文件夹或归档已不存在的条目跳过。
+    """
+    wanted = set(song_hash.lower() for song_hash in hashes if song_hash)
+    found = {}
+    for entry in reversed(index_backup_folders(backup_folder, progress=progress, cancelled=cancelled)):  # 清单按时间排列，倒序即从新到旧
+        song_hash = (entry.get('hash') or '').lower()
+        if (song_hash in wanted and song_hash not in found
+                and os.path.exists(os.path.join(backup_folder, entry['backup_path']))):
+            found[song_hash] = entry
+    return found
+
+
+class RestoreSession:
+    """一次恢复操作：把备份清单中的歌曲文件夹恢复到歌曲文件夹，可在多个线程中同时调用
+
+    - 备份文件夹与歌曲文件夹在同一文件系统时直接 os.replace 移回（备份随之移出 backup，清单中的条目会被删除）；
+    - 跨文件系统时复制，归档中的歌曲解压，都先写入歌曲文件夹中的临时目录，完成后再改名，
+      不会留下只恢复了一半的歌曲文件夹；
+    - 目标文件夹已存在时改名为“名称 (2)”等，不会覆盖。
+    """
+
+    def __init__(self, backup_folder, songs_folder):
+        self.backup_folder = backup_folder
+        self.songs_folder = songs_folder
+        self.restored = []              # [(清单条目, 恢复后的文件夹路径), ...]
+        self._moved = []                # 备份已被移回的清单条目
+        self._lock = threading.Lock()
+        self._reserved = set()
+        self._songs_dev = os.stat(songs_folder).st_dev
+
+    def reserve_path(self, name):
+        with self._lock:
+            path = unique_path(os.path.join(self.songs_folder, name), self._reserved)
+            self._reserved.add(path)
+            return path
+
+    def restore(self, entry):
+        """恢复一个清单条目，返回恢复后的文件夹路径"""
+        source = os.path.join(self.backup_folder, entry['backup_path'])
+        target = self.reserve_path(os.path.basename(os.path.normpath(entry['original_path'])))
+        moved = False
+        if entry['method'] != 'archive' and os.stat(source).st_dev == self._songs_dev:
+            os.replace(source, target)
+            moved = True
+        else:
+            tmp_path = self.reserve_path(f".{os.path.basename(target)}.restoring")
+            try:
+                if entry['method'] == 'archive':
+                    self.extract_member(source, entry['member'], tmp_path)
+                else:
+                    shutil.copytree(source, tmp_path)
+                os.replace(tmp_path, target)
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+        with self._lock:
+            self.restored.append((entry, target))
+            if moved:
+                self._moved.append(entry)
+        return target
+
+    @staticmethod
+    def extract_member(archive_path, member, dest):
+        """把归档中顶层目录 member 下的文件解压到 dest（路径越出 dest 的条目视为归档损坏）"""
+        import tarfile
+        import zipfile
+        dest = os.path.abspath(dest)
+
+        def dest_path(name):
+            path = os.path.normpath(os.path.join(dest, name[len(member):].lstrip('/')))
+            if path != dest and not path.startswith(dest + os.sep):
+                raise ValueError(f"归档中的路径不安全: {name}")
+            return path
+
+        os.makedirs(dest)
+        if archive_path.endswith('.zip'):
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if info.filename.rstrip('/') != member and not info.filename.startswith(member + '/'):
+                        continue
+                    path = dest_path(info.filename)
+                    if info.is_dir():
+                        os.makedirs(path, exist_ok=True)
+                        continue
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with archive.open(info) as src, open(path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+            return
+        if zstandard is None:
+            raise RuntimeError("未安装 zstandard，无法读取 tar.zst 归档")
+        # tar.zst 只能顺序读取，一次遍历取出该目录下的文件
+        with open(archive_path, 'rb') as f, zstandard.ZstdDecompressor().stream_reader(f) as stream, \
+                tarfile.open(fileobj=stream, mode='r|') as archive:
+            for info in archive:
+                if info.name != member and not info.name.startswith(member + '/'):
+                    continue
+                path = dest_path(info.name)
+                if info.isdir():
+                    os.makedirs(path, exist_ok=True)
+                elif info.isfile():
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with archive.extractfile(info) as src, open(path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+
+    def close(self):
+        """从备份清单中删除已移回歌曲文件夹的条目"""
+        with self._lock:
+            if not self._moved:
+                return
+            moved_keys = set((entry['backup_path'], entry['time']) for entry in self._moved)
+            entries = [entry for entry in load_backup_manifest(self.backup_folder)
+                       if (entry['backup_path'], entry['time']) not in moved_keys]
+            save_backup_manifest(self.backup_folder, entries)
+            self._moved = []
+
+
+NORMAL_HARD_MASK = DIFFICULTY_BITS['Normal'] | DIFFICULTY_BITS['Hard']
+# 筛选模式 -> (难度掩码 & NORMAL_HARD_MASK) 应等于的值
+FILTER_MODE_MASKS = {
+    1: DIFFICULTY_BITS['Normal'],   # 普通不含困难
+    2: DIFFICULTY_BITS['Hard'],     # 困难不含普通
+    3: 0,                           # 不含普通和困难
+}
+
+
+class SongSearchIndex:
+    """歌曲列表的筛选/搜索索引，每次扫描完成后建立一次
+
+    预先保存小写的“歌名\n作者”搜索键、难度位掩码、是否缺失，以及每种排序方式的行顺序；
+    search() 只做一遍列表推导。关键字在上一次关键字基础上继续输入（新关键字包含旧关键字）
+    且其它条件不变时，直接在上一次的结果中继续筛选。
+    """
+
+    def __init__(self, songs):
+        self.search_keys = [f"{song.name}\n{song.author}".lower() for song in songs]
+        self.diff_masks = [song.diff_mask for song in songs]
+        self.missing = [not song.exists for song in songs]
+        rows = range(len(songs))
+        by_name = lambda i: songs[i].name
+        by_author = lambda i: songs[i].author
+        self.orders = {
+            0: list(rows),                                  # 歌单顺序
+            1: sorted(rows, key=by_name),                   # 歌名升序
+            2: sorted(rows, key=by_name, reverse=True),     # 歌名降序
+            3: sorted(rows, key=by_author),                 # 作者升序
+            4: sorted(rows, key=by_author, reverse=True),   # 作者降序
+        }
+        self.base_rows = {}     # (排序, 筛选, 仅缺失) -> 未应用关键字时的行
+        self.last_query = None  # 上一次的 (排序, 筛选, 仅缺失, 关键字)
+        self.last_rows = []
+
+    def rows_without_keyword(self, sort_mode, filter_mode, only_missing):
+        """按排序、难度筛选和仅显示缺失得到的行，结果会缓存"""
+        key = (sort_mode, filter_mode, only_missing)
+        rows = self.base_rows.get(key)
+        if rows is None:
+            rows = self.orders.get(sort_mode, self.orders[0])
+            expected = FILTER_MODE_MASKS.get(filter_mode)
+            if expected is not None:
+                masks = self.diff_masks
+                rows = [i for i in rows if masks[i] & NORMAL_HARD_MASK == expected]
+            if only_missing:
+                missing = self.missing
+                rows = [i for i in rows if missing[i]]
+            self.base_rows[key] = rows
+        return rows
+
+    def search(self, filter_mode, sort_mode, only_missing, keyword):
+        """返回满足条件的歌曲下标列表（按所选排序方式排列），keyword 需已小写"""
+        last = self.last_query
+        if (keyword and last is not None and last[:3] == (sort_mode, filter_mode, only_missing)
+                and last[3] in keyword):
+            rows = self.last_rows  # 关键字收窄：在上一次结果中继续筛选
+        else:
+            rows = self.rows_without_keyword(sort_mode, filter_mode, only_missing)
+        if keyword:
+            keys = self.search_keys
+            rows = [i for i in rows if keyword in keys[i]]
+        self.last_query = (sort_mode, filter_mode, only_missing, keyword)
+        self.last_rows = rows
+        return rows
+
+
+REPORT_FIELDS = ['playlist', 'title', 'name', 'hash', 'exists', 'path', 'author', 'difficulties', 'missing_files',
+                 'cache_id']
+
+
+def build_arg_parser():
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='playlist_engine',
+        description="Beat Saber 歌单与歌曲文件夹的命令行工具（无需图形界面）")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--songs', required=True, help="歌曲文件夹（如 Beat Saber_Data/CustomLevels）")
+    source = common.add_mutually_exclusive_group(required=True)
+    source.add_argument('--playlists', help="Playlists 目录，评估其中所有 .bplist/.json 歌单")
+    source.add_argument('--playlist', nargs='+', help="一个或多个歌单文件")
+    common.add_argument('--cache', default=None, help="LocalCache.saver 路径（默认使用程序同级的文件）")
+    common.add_argument('--index', default=None, help="扫描索引路径（默认使用程序同级的 ScanIndex.json）")
+    common.add_argument('--no-index', action='store_true', help="不读取也不写入扫描索引")
+    common.add_argument('--force-rescan', action='store_true', help="忽略扫描索引，重新解析所有文件夹")
+    common.add_argument('--executor', choices=['thread', 'process'], default='thread', help="并行解析方式")
+    common.add_argument('--workers', type=int, default=None, help="并行解析数")
+    common.add_argument('--timings', action='store_true',
+                        help=f"在标准错误输出各阶段耗时，并追加到程序同级的 {TIMINGS_LOG_NAME}")
+    common.add_argument('--profile', default=None, metavar='FILE', help="用 cProfile 记录整个命令并保存到 FILE")
+    common.add_argument('--fetch-metadata', action='store_true',
+                        help=f"向 BeatSaver 查询 LocalCache.saver 中没有的歌曲信息，结果缓存到程序同级的 {METADATA_CACHE_NAME}")
+    common.add_argument('--api', default=BEATSAVER_API, help="BeatSaver API 地址（默认 %(default)s）")
+
+    sub.add_parser('scan', parents=[common], help="扫描并输出每个歌单的存在/缺失统计")
+
+    report = sub.add_parser('report', parents=[common], help="输出每首歌的详细结果（JSON/CSV）")
+    report.add_argument('--format', choices=['json', 'csv'], default='json')
+    report.add_argument('--output', '-o', default='-', help="输出文件，默认标准输出")
+    report.add_argument('--missing-only', action='store_true', help="只输出本地缺失的歌曲")
+
+    sub.add_parser('orphans', parents=[common], help="列出没有被任何歌单引用的歌曲文件夹")
+
+    sub.add_parser('duplicates', parents=[common], help="列出重复的歌曲文件夹和可释放的空间")
+
+    restore = sub.add_parser('restore', parents=[common], help="从备份中恢复歌单里本地缺失的歌曲")
+    restore.add_argument('--backup', default=None, help="备份文件夹（默认使用程序同级的 backup）")
+    restore.add_argument('--dry-run', action='store_true', help="只显示备份中能找到的歌曲，不恢复")
+
+    prune = sub.add_parser('prune', parents=[common], help="从歌单中移除本地缺失的歌曲")
+    prune.add_argument('--orphans', action='store_true',
+                       help="同时删除没有被任何歌单引用的歌曲文件夹（先备份到 backup）")
+    prune.add_argument('--duplicates', action='store_true',
+                       help="同时删除重复的歌曲文件夹，每组保留歌单匹配使用的文件夹（先备份到 backup）")
+    prune.add_argument('--dry-run', action='store_true', help="只显示将要移除的歌曲，不修改文件")
+    prune.add_argument('--no-backup', action='store_true', help="修改前不备份歌单和歌曲文件夹")
+    prune.add_argument('--compact', choices=('never', 'auto', 'always'), default='never',
+                       help=f"歌单写成紧凑 JSON：auto 只对不少于 {COMPACT_PLAYLIST_SONGS} 首的歌单（默认 never）")
+    return parser
+
+
+def index_path_from_args(args):
+    """扫描索引路径，--no-index 时为 None"""
+    return None if args.no_index else (args.index or os.path.join(get_app_dir(), SCAN_INDEX_NAME))
+
+
+def scan_from_args(args):
+    """按命令行参数扫描歌曲文件夹（只扫描一次）并评估所有歌单"""
+    app_dir = get_app_dir()
+    index_path = index_path_from_args(args)
+    cache_path = args.cache or os.path.join(app_dir, CACHE_NAME)
+    playlist_paths = find_playlists(args.playlists) if args.playlists else args.playlist
+    timings = StageTimings()
+    library = SongLibrary(args.songs).scan(
+        index_path=index_path, force_rescan=args.force_rescan,
+        executor_kind=args.executor, max_workers=args.workers,
+        status=lambda text: print(text, file=sys.stderr), timings=timings)
+    print(f"歌曲文件夹：{len(library.local_folders)} 个（索引命中 {library.index_hits}，"
+          f"重新解析 {library.index_misses}）", file=sys.stderr)
+    errors = []
+    metadata = MetadataCache(os.path.join(app_dir, METADATA_CACHE_NAME)).load()
+    results = evaluate_playlists(playlist_paths, library, cache_path, errors=errors, timings=timings,
+                                 metadata=metadata)
+    for path, error in errors:
+        print(f"歌单读取失败，已跳过: {path} - {error}", file=sys.stderr)
+    if args.fetch_metadata:
+        with timings.stage('metadata') as record:
+            record['count'] = fetch_metadata(results, metadata, args.api)
+    if args.timings:
+        print(timings.summary(), file=sys.stderr)
+        try:
+            timings.write_log(os.path.join(app_dir, TIMINGS_LOG_NAME), event='cli', command=args.command,
+                              songs_folder=args.songs, playlists=len(results),
+                              folders=len(library.local_folders), index_hits=library.index_hits,
+                              index_misses=library.index_misses, executor=args.executor)
+        except OSError as e:
+            print(f"耗时日志写入失败: {e}", file=sys.stderr)
+    return library, results
+
+
+def fetch_metadata(results, metadata, api):
+    """联网查询各歌单中缺少 id 且缓存中没有记录的 hash，结果写入缓存并填入歌曲信息，返回查询的 hash 数"""
+    hashes = metadata.unknown(song.hash for result in results for song in result['songs'] if not song.cache_id)
+    if not hashes:
+        return 0
+    print(f"正在向 {api} 查询 {len(hashes)} 首歌曲的信息...", file=sys.stderr)
+    import asyncio
+    errors = []
+    found = {}
+    try:
+        asyncio.run(MetadataResolver(api).resolve(hashes, errors=errors, results=found))
+    except Exception as e:
+        errors.append(f"查询中断: {e}")
+    metadata.update(found)
+    try:
+        metadata.save()
+    except OSError as e:
+        print(f"歌曲信息缓存保存失败: {e}", file=sys.stderr)
+    for result in results:
+        apply_metadata(result['songs'], found)
+    resolved = sum(1 for entry in found.values() if entry)
+    print(f"查询到 {resolved} 首，BeatSaver 上不存在 {len(found) - resolved} 首", file=sys.stderr)
+    for error in errors:
+        print(error, file=sys.stderr)
+    return len(hashes)
+
+
+def refs_from_args(args):
+    """按命令行参数建立歌单反向索引：--playlists 目录，或 --playlist 文件所在的目录"""
+    if args.playlists:
+        dirs = [args.playlists]
+    else:
+        dirs = sorted(set(os.path.dirname(os.path.abspath(path)) for path in args.playlist))
+    ref_index = PlaylistRefIndex(os.path.join(get_app_dir(), PLAYLIST_REFS_NAME)).load().update(dirs)
+    try:
+        ref_index.save()
+    except OSError as e:
+        print(f"歌单反向索引保存失败: {e}", file=sys.stderr)
+    for path, error in ref_index.errors:
+        print(f"歌单读取失败: {path} - {error}", file=sys.stderr)
+    return ref_index
+
+
+def orphans_from_args(args, library, results):
+    """按命令行参数查找孤立的歌曲文件夹；有歌单读取失败时无法判断，返回 None"""
+    ref_index = refs_from_args(args)
+    if ref_index.errors:
+        return None
+    metadata = MetadataCache(os.path.join(get_app_dir(), METADATA_CACHE_NAME)).load()
+    cache_info = ref_index.referenced_cache_info(args.cache or os.path.join(get_app_dir(), CACHE_NAME), metadata)
+    matched = [song.path for result in results for song in result['songs'] if song.exists]
+    return ref_index.find_orphans(library, matched, cache_info)
+
+
+def report_rows(results, missing_only=False):
+    for result in results:
+        for song in result['songs']:
+            if missing_only and song.exists:
+                continue
+            row = {field: getattr(song, field, '') for field in REPORT_FIELDS}
+            row.update(playlist=result['path'], title=result['title'],
+                       difficulties='/'.join(song.difficulties),
+                       missing_files='/'.join(song.missing_files))
+            yield row
+
+
+def cli_main(argv=None):
+    """命令行入口"""
+    args = build_arg_parser().parse_args(argv)
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run_command, args)
+        finally:
+            profiler.dump_stats(args.profile)
+            print(f"性能分析结果已保存到 {args.profile}", file=sys.stderr)
+    return run_command(args)
+
+
+def run_command(args):
+    """执行解析后的子命令"""
+    library, results = scan_from_args(args)
+
+    if args.command == 'scan':
+        for result in results:
+            total = len(result['songs'])
+            existing = sum(1 for song in result['songs'] if song.exists)
+            incomplete = sum(1 for song in result['songs'] if song.missing_files)
+            print(f"{result['title']}\t总数 {total}\t存在 {existing}\t缺失 {total - existing}"
+                  f"\t文件不完整 {incomplete}\t{result['path']}")
+
+    elif args.command == 'report':
+        out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+        try:
+            if args.format == 'json':
+                json.dump([dict(result, songs=[song.to_dict() for song in result['songs']
+                                                if not (args.missing_only and song.exists)])
+                           for result in results], out, indent=2, ensure_ascii=False)
+                out.write('\n')
+            else:
+                import csv
+                writer = csv.DictWriter(out, fieldnames=REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(report_rows(results, args.missing_only))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+    elif args.command == 'orphans':
+        orphans = orphans_from_args(args, library, results)
+        if orphans is None:
+            print("有歌单读取失败，无法确定哪些歌曲未被引用", file=sys.stderr)
+            return 1
+        for local in orphans:
+            print(f"{local['hash']}\t{local['name']}\t{local['folder']}")
+
+    elif args.command == 'duplicates':
+        matched = [song.path for result in results for song in result['songs'] if song.exists]
+        groups = find_duplicates(library, max_workers=args.workers, matched_folders=matched)
+        for group in groups:
+            print(f"{group['name']} [{group['hash'] or '无 hash'}] 可释放 {format_size(group['reclaimable'])}")
+            print(f"  保留 {group['keep']['folder']} ({format_size(group['sizes'][group['keep']['folder']])})")
+            for local in group['duplicates']:
+                same = "，内容完全相同" if local['folder'] in group['identical'] else ""
+                print(f"  重复 {local['folder']} ({format_size(group['sizes'][local['folder']])}{same})")
+        print(f"重复组：{len(groups)} 个，共可释放 {format_size(sum(group['reclaimable'] for group in groups))}")
+
+    elif args.command == 'restore':
+        backup_folder = args.backup or os.path.join(get_app_dir(), BACKUP_FOLDER_NAME)
+        missing = set(song.hash for result in results for song in result['songs'] if not song.exists and song.hash)
+        found = find_restorable(backup_folder, missing)
+        print(f"缺失的歌曲：{len(missing)} 首，备份中找到 {len(found)} 首")
+        for entry in found.values():
+            print(f"  - {entry['name']} ({entry['backup_path']})")
+        if args.dry_run or not found:
+            return 0
+        session = RestoreSession(backup_folder, args.songs)
+        failed = 0
+        try:
+            with ThreadPoolExecutor(max_workers=FILE_JOB_WORKERS) as executor:
+                futures = {executor.submit(session.restore, entry): entry for entry in found.values()}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"恢复失败: {futures[future]['name']} - {e}", file=sys.stderr)
+        finally:
+            session.close()
+        # 只重新解析恢复出来的文件夹，确认其中有可用的 info.dat 和 .egg
+        restored = {os.path.basename(path): entry for entry, path in session.restored}
+        library.refresh(restored, index_path_from_args(args))
+        parsed = {os.path.basename(local['folder']): local for local in library.local_folders}
+        broken = [entry for folder, entry in restored.items()
+                  if folder not in parsed or not parsed[folder]['egg_ok']]
+        for entry in broken:
+            print(f"恢复后校验未通过: {entry['name']}", file=sys.stderr)
+        print(f"已恢复 {len(restored)} 首，校验通过 {len(restored) - len(broken)} 首，失败 {failed} 首")
+        return 1 if failed or broken else 0
+
+    elif args.command == 'prune':
+        backup = None
+        if not args.dry_run and not args.no_backup:
+            backup_folder = os.path.join(get_app_dir(), BACKUP_FOLDER_NAME)
+            os.makedirs(backup_folder, exist_ok=True)
+            backup = BackupSession(backup_folder)
+        try:
+            # 所有歌单的修改在一个事务中提交：任何一个写入失败，所有歌单都保持原样；
+            # 只有替换阶段失败时前面的歌单已经改好，此时列出已替换的歌单
+            transaction = PlaylistTransaction({'never': False, 'auto': 'auto', 'always': True}[args.compact])
+            for result in results:
+                missing = [song for song in result['songs'] if not song.exists]
+                if not missing:
+                    continue
+                print(f"{result['title']}：缺失 {len(missing)} 首（{result['path']}）")
+                for song in missing:
+                    print(f"  - {song.name} [{song.hash}]")
+                if args.dry_run:
+                    continue
+                if backup:
+                    backup.backup_file(result['path'])
+                transaction.remove(result['path'], [song.hash for song in missing])
+            try:
+                committed = transaction.commit()
+            except OSError:
+                for path in transaction.committed:
+                    print(f"已替换 {path}，其余歌单未修改", file=sys.stderr)
+                raise
+            for path, removed in committed.items():
+                print(f"已从 {path} 移除 {removed} 首")
+            if args.duplicates:
+                matched = [song.path for result in results for song in result['songs'] if song.exists]
+                groups = find_duplicates(library, max_workers=args.workers, matched_folders=matched)
+                print(f"重复的歌曲文件夹：{sum(len(group['duplicates']) for group in groups)} 个，"
+                      f"可释放 {format_size(sum(group['reclaimable'] for group in groups))}")
+                deleted = set()
+                for group in groups:
+                    for local in group['duplicates']:
+                        print(f"  - {local['name']} ({local['folder']})")
+                        if args.dry_run:
+                            continue
+                        if backup:
+                            backup.backup_and_delete(SongRecord.from_local(local))
+                        else:
+                            shutil.rmtree(local['folder'])
+                        deleted.add(local['folder'])
+                # 已删除的重复文件夹不再参与后面的孤立歌曲判断
+                library.set_folders([local for local in library.local_folders if local['folder'] not in deleted])
+            if args.orphans:
+                orphans = orphans_from_args(args, library, results)
+                if orphans is None:
+                    print("有歌单读取失败，无法确定哪些歌曲未被引用，跳过删除孤立歌曲", file=sys.stderr)
+                    return 1
+                print(f"未被任何歌单引用的歌曲文件夹：{len(orphans)} 个")
+                for local in orphans:
+                    print(f"  - {local['name']} ({local['folder']})")
+                    if args.dry_run:
+                        continue
+                    if backup:
+                        backup.backup_and_delete(SongRecord.from_local(local))
+                    else:
+                        shutil.rmtree(local['folder'])
+        finally:
+            if backup:
+                backup.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli_main())